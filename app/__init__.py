@@ -2,6 +2,7 @@ import os
 import logging
 from logging.handlers import RotatingFileHandler # Import for logging setup
 from flask import Flask, jsonify, request, make_response
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timezone, timedelta
 import werkzeug.exceptions # Import explicitly for error handler type hint
 
@@ -9,6 +10,7 @@ import werkzeug.exceptions # Import explicitly for error handler type hint
 from .config import config_by_name, get_config_name
 from .extensions import cors, jwt, db
 from .utils.audit import setup_audit_logging
+from .commands import register_commands
 
 # --- IMPORT BLUEPRINTS ---
 from .routes.auth import auth_bp
@@ -20,6 +22,8 @@ from .routes.shared import shared_bp
 # --- IMPORT SERVICE INSTANCES ---
 # Import instances that need init_app called
 from .services.file_service import file_service
+from .services.share_service import share_service
+from .services.conversion_service import conversion_service
 # Import others if they were changed to need init_app
 # from .services.auth_service import auth_service
 # from .services.team_service import team_service
@@ -51,6 +55,11 @@ def create_app(config_name=None):
         app.config.from_object(config_by_name[config_name])
 
 
+    # Trust X-Forwarded-For only as far as the configured proxies, so remote_addr is the real
+    # client (per-IP share throttling) and can't be spoofed by clients adding their own header
+    if app.config.get('PROXY_FIX_X_FOR'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
     # --- Initialize Extensions ---
     cors.init_app(app)
     jwt.init_app(app)
@@ -65,9 +74,10 @@ def create_app(config_name=None):
     # --- Initialize Services that need the app context ---
     try:
         file_service.init_app(app) # Initialize FileService here
+        conversion_service.init_app(app) # LibreOffice worker pool for office previews
         # auth_service.init_app(app) # If needed
         # team_service.init_app(app) # If needed
-        # share_service.init_app(app) # If needed
+        share_service.init_app(app) # Share token cache sizes/TTLs
         # user_service.init_app(app) # If needed
     except Exception as service_init_error:
          app.logger.critical(f"CRITICAL: Service initialization failed: {service_init_error}", exc_info=True)
@@ -128,6 +138,9 @@ def create_app(config_name=None):
     app.register_blueprint(shared_bp)
     app.logger.info("Blueprints registered.")
 
+    # --- CLI Commands ---
+    register_commands(app)
+
 
     # --- Global Request Hooks ---
     @app.before_request
@@ -219,5 +232,12 @@ def create_app(config_name=None):
     def home():
         return jsonify({"message": "API is running", "status": "OK"}), 200
 
+    @app.route('/ready')
+    def ready():
+        """Readiness probe. Opens the (lazy) CouchDB connection on first call."""
+        if not db.ensure_connected():
+            return jsonify({"status": "unavailable", "database": "unreachable"}), 503
+        return jsonify({"status": "ready", "database": "connected", "schema_ready": db.schema_ready.is_set()}), 200
+
     app.logger.info("Application creation complete.")
     return app
\ No newline at end of file
@@ -0,0 +1,114 @@
+# app/commands.py
+"""Maintenance commands for the `flask` CLI (e.g. `flask shares migrate-ids`, `flask files reindex`, `flask db ...`)."""
+
+import click
+from flask import Flask
+
+from app.extensions import db
+from app.services.share_service import share_service
+from app.services.file_service import file_service
+
+
+shares_cli = click.Group("shares", help="Share link maintenance.")
+files_cli = click.Group("files", help="File storage maintenance.")
+db_cli = click.Group("db", help="CouchDB document maintenance.")
+
+
+@shares_cli.command("migrate-ids")
+@click.option("--batch-size", default=500, show_default=True, help="Share docs per _bulk_docs request.")
+@click.option("--dry-run", is_flag=True, help="Only count the share links that would be re-keyed.")
+def migrate_share_ids(batch_size, dry_run):
+    """Re-key legacy share links to share:<sha256(token)> document IDs."""
+    if not db.ensure_connected():
+        raise click.ClickException("CouchDB is not reachable.")
+    counts = db.migrate_share_links(batch_size=batch_size, dry_run=dry_run)
+    click.echo(f"{'Would migrate' if dry_run else 'Migrated'} {counts['migrated']} of {counts['scanned']} share links "
+               f"({counts['already_keyed']} already keyed, {counts['errors']} errors).")
+    if counts["errors"]:
+        raise SystemExit(1)
+
+
+@shares_cli.command("sweep")
+@click.option("--batch-size", default=None, type=int, help="Share docs per request (default SHARE_SWEEP_BATCH).")
+def sweep_expired_shares(batch_size):
+    """Remove share links past their expiry (plus SHARE_SWEEP_GRACE) now."""
+    if not db.ensure_connected():
+        raise click.ClickException("CouchDB is not reachable.")
+    result = share_service.sweep_expired_links(batch_size=batch_size)
+    click.echo(f"Reclaimed {result['reclaimed']} expired share links in {result.get('duration_s', 0)}s.")
+    if result.get("error"):
+        raise click.ClickException(result["error"])
+
+
+@db_cli.command("backfill-created-at")
+@click.option("--batch-size", default=500, show_default=True, help="Docs per _bulk_docs request.")
+@click.option("--dry-run", is_flag=True, help="Only count the docs that would be updated.")
+def backfill_created_at(batch_size, dry_run):
+    """Give user/team docs without created_at one, so ?sort=created_at lists include them."""
+    if not db.ensure_connected():
+        raise click.ClickException("CouchDB is not reachable.")
+    counts = db.backfill_created_at(batch_size=batch_size, dry_run=dry_run)
+    click.echo(f"{'Would update' if dry_run else 'Updated'} {counts['updated']} of {counts['scanned']} docs "
+               f"without created_at ({counts['errors']} errors).")
+    if counts["errors"]:
+        raise SystemExit(1)
+
+
+def _index_user_ids(user_id):
+    if not file_service.index.enabled:
+        raise click.ClickException("The file index is disabled (FILE_INDEX_ENABLED).")
+    if user_id:
+        return [user_id]
+    return sorted(entry.name for entry in file_service.base_upload_folder.iterdir() if entry.is_dir())
+
+
+@files_cli.command("reindex")
+@click.option("--user-id", default=None, help="Only this user (default: every user directory).")
+def reindex_files(user_id):
+    """Rebuild the file name index from the storage tree."""
+    for uid in _index_user_ids(user_id):
+        result = file_service.index.rebuild(uid, file_service._get_user_root_path(uid))
+        click.echo(f"{uid}: indexed {result['entries']} entries in {result['duration_s']}s.")
+
+
+@files_cli.command("verify")
+@click.option("--user-id", default=None, help="Only this user (default: every user directory).")
+@click.option("--repair", is_flag=True, help="Apply the differences found to the index.")
+def verify_files(user_id, repair):
+    """Compare the file name index with the storage tree."""
+    drifted = 0
+    for uid in _index_user_ids(user_id):
+        result = file_service.index.verify(uid, file_service._get_user_root_path(uid), repair=repair)
+        differences = result["missing"] + result["stale"] + result["orphaned"]
+        drifted += 1 if differences or not result["built"] else 0
+        click.echo(f"{uid}: {result['on_disk']} on disk, {result['indexed']} indexed, {result['missing']} missing, "
+                   f"{result['stale']} stale, {result['orphaned']} orphaned{'' if result['built'] else ', never built'}"
+                   f"{' (repaired)' if repair and differences else ''}.")
+    if drifted and not repair:
+        raise SystemExit(1)
+
+
+@files_cli.command("extract")
+@click.option("--user-id", default=None, help="Only this user (default: every user directory).")
+def extract_file_contents(user_id):
+    """Extract document text for content search now, instead of in the background."""
+    for uid in _index_user_ids(user_id):
+        user_root = file_service._get_user_root_path(uid)
+        if not file_service.index.is_built(uid):
+            file_service.index.rebuild(uid, user_root)
+        processed = 0
+        while True:
+            batch = file_service.index.extract_pending(uid, user_root)
+            processed += batch
+            if not batch:
+                break
+        click.echo(f"{uid}: extracted text from {processed} files.")
+    stats = file_service.index.extract_stats()
+    click.echo(f"{stats['extracted']} extracted, {stats['failed']} failed, {stats['skipped_large']} skipped as too large.")
+
+
+def register_commands(app: Flask):
+    """Attach the CLI command groups to the app."""
+    app.cli.add_command(shares_cli)
+    app.cli.add_command(files_cli)
+    app.cli.add_command(db_cli)
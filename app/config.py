@@ -22,11 +22,58 @@ class Config:
     JWT_COOKIE_SAMESITE = "None" # Use "Lax" or "Strict" if frontend is same-site
     JWT_COOKIE_DOMAIN = os.environ.get('JWT_COOKIE_DOMAIN') # Set your domain in production via .env
 
+    # Reverse proxies (Nginx) in front of the app that append to X-Forwarded-For.
+    # request.remote_addr is then the client address the nearest proxy saw; 0 when serving clients directly.
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 1))
+
     # Database / File Storage Paths (relative to project root assumed by default)
     BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
     DATABASE_FILES_DIR = os.path.join(BASE_DIR, os.environ.get('DATABASE_FILES_DIR', 'files'))
     LOG_DIR = os.path.join(BASE_DIR, os.environ.get('LOG_DIR', 'logs'))
 
+    # Per-user SQLite index of file names/metadata behind /files/search (keep outside DATABASE_FILES_DIR)
+    FILE_INDEX_ENABLED = os.environ.get('FILE_INDEX_ENABLED', 'True').lower() == 'true'
+    FILE_INDEX_DIR = os.path.join(BASE_DIR, os.environ.get('FILE_INDEX_DIR', 'file_index'))
+    FILE_INDEX_BUSY_TIMEOUT = float(os.environ.get('FILE_INDEX_BUSY_TIMEOUT', 10)) # Seconds to wait for a locked index
+
+    # Content search: text of txt/PDF/docx files extracted in the background into the file index
+    CONTENT_INDEX_ENABLED = os.environ.get('CONTENT_INDEX_ENABLED', 'True').lower() == 'true'
+    CONTENT_INDEX_MAX_FILE_BYTES = int(os.environ.get('CONTENT_INDEX_MAX_FILE_BYTES', 50 * 1024 * 1024)) # Larger files are not extracted
+    CONTENT_INDEX_MAX_CHARS = int(os.environ.get('CONTENT_INDEX_MAX_CHARS', 1_000_000)) # Text kept per document
+    CONTENT_INDEX_BATCH = int(os.environ.get('CONTENT_INDEX_BATCH', 50)) # Files per extractor pass before yielding to other users
+
+    # Rendered image previews, keyed by source path/mtime/size/rendition, LRU-evicted above the budget
+    PREVIEW_CACHE_ENABLED = os.environ.get('PREVIEW_CACHE_ENABLED', 'True').lower() == 'true'
+    PREVIEW_CACHE_DIR = os.path.join(BASE_DIR, os.environ.get('PREVIEW_CACHE_DIR', 'preview_cache'))
+    PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 1024 ** 3))
+    PREVIEW_RENDITIONS = [int(px) for px in os.environ.get('PREVIEW_RENDITIONS', '128,512,1280').split(',')] # ?size= choices
+    PREVIEW_PREGENERATE_FORMATS = [f for f in os.environ.get('PREVIEW_PREGENERATE_FORMATS', 'webp,jpeg').split(',') if f] # Rendered right after image uploads
+    PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2)) # Background rendition threads per worker process
+    PREVIEW_MAX_PIXELS = int(os.environ.get('PREVIEW_MAX_PIXELS', 100_000_000)) # Larger source images get 413
+    PREVIEW_MAX_DECODE_BYTES = int(os.environ.get('PREVIEW_MAX_DECODE_BYTES', 512 * 1024 * 1024)) # After scaled (draft) decoding
+
+    # Office (docx/doc) -> PDF conversion pool; each worker keeps its own LibreOffice profile
+    OFFICE_WORKERS = int(os.environ.get('OFFICE_WORKERS', 2)) # Concurrent soffice processes per worker process
+    OFFICE_JOB_TIMEOUT = int(os.environ.get('OFFICE_JOB_TIMEOUT', 60)) # Seconds before a conversion is killed
+    OFFICE_REQUEST_WAIT = int(os.environ.get('OFFICE_REQUEST_WAIT', 30)) # Seconds a preview request waits before answering 202
+    OFFICE_QUEUE_MAX = int(os.environ.get('OFFICE_QUEUE_MAX', 100))
+    OFFICE_PROFILE_DIR = os.path.join(BASE_DIR, os.environ.get('OFFICE_PROFILE_DIR', 'office_profiles'))
+    # Converted PDFs, content-addressed (sha256 of the source) and LRU-evicted above the budget
+    CONVERSION_CACHE_DIR = os.path.join(BASE_DIR, os.environ.get('CONVERSION_CACHE_DIR', 'conversion_cache'))
+    CONVERSION_CACHE_MAX_BYTES = int(os.environ.get('CONVERSION_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+    # docx previews: "pdf" converts everything with LibreOffice, "html" renders simple documents
+    # in-process and only sends complex ones (images, text boxes, equations, ...) to LibreOffice
+    DOCX_PREVIEW_MODE = os.environ.get('DOCX_PREVIEW_MODE', 'pdf')
+    DOCX_PREVIEW_MAX_XML_BYTES = int(os.environ.get('DOCX_PREVIEW_MAX_XML_BYTES', 64 * 1024 * 1024))
+    # Cache-Control per file route (ETag/Last-Modified revalidation makes no-cache cheap: 304s)
+    CACHE_CONTROL_DOWNLOAD = os.environ.get('CACHE_CONTROL_DOWNLOAD', 'private, no-cache')
+    CACHE_CONTROL_PREVIEW = os.environ.get('CACHE_CONTROL_PREVIEW', 'private, max-age=60')
+    CACHE_CONTROL_SHARED = os.environ.get('CACHE_CONTROL_SHARED', 'private, no-cache')
+
+    # Cursor pagination for list endpoints
+    PAGE_SIZE_DEFAULT = 100
+    PAGE_SIZE_MAX = 1000
+
     # Audit Log Config
     AUDIT_LOG_FILE = os.path.join(LOG_DIR, 'audit.log')
     AUDIT_LOG_MAX_BYTES = 10_000_000
@@ -39,6 +86,52 @@ class Config:
     DB_PASSWORD = os.environ.get('DB_PASSWORD')
     DB_NAME = os.environ.get('DB_NAME', 'nas_db')
 
+    # Connect to CouchDB on first use (first request / readiness probe) instead of at startup;
+    # index and design-doc checks then run in a background thread
+    COUCHDB_LAZY_CONNECT = os.environ.get('COUCHDB_LAZY_CONNECT', 'True').lower() == 'true'
+
+    # CouchDB HTTP connection pool (per worker process)
+    COUCHDB_POOL_SIZE = int(os.environ.get('COUCHDB_POOL_SIZE', 10)) # Max concurrent connections
+    COUCHDB_POOL_TIMEOUT = float(os.environ.get('COUCHDB_POOL_TIMEOUT', 10)) # Seconds to wait for a free connection
+    COUCHDB_CONNECT_TIMEOUT = float(os.environ.get('COUCHDB_CONNECT_TIMEOUT', 5))
+    COUCHDB_READ_TIMEOUT = float(os.environ.get('COUCHDB_READ_TIMEOUT', 20))
+    COUCHDB_KEEPALIVE_IDLE = float(os.environ.get('COUCHDB_KEEPALIVE_IDLE', 60)) # Drop idle connections after N seconds
+
+    # Fall back to the Mango token index for share links created before token-keyed IDs.
+    # Turn off once `flask shares migrate-ids` has run, so unknown tokens cost a single GET.
+    SHARE_LEGACY_LOOKUP = os.environ.get('SHARE_LEGACY_LOOKUP', 'True').lower() == 'true'
+
+    # Signed public share links (v1.<payload>.<hmac>) are verified without CouchDB
+    SHARE_SIGNING_KEY = os.environ.get('SHARE_SIGNING_KEY') # Unset: signed links disabled. Dedicated random secret, >= 32 chars
+    SHARE_REVOCATION_REFRESH = int(os.environ.get('SHARE_REVOCATION_REFRESH', 60)) # Seconds between revocation list reloads
+
+    # Background removal of expired share links (every worker runs one from its first request; deletes are idempotent)
+    SHARE_SWEEP_ENABLED = os.environ.get('SHARE_SWEEP_ENABLED', 'True').lower() == 'true'
+    SHARE_SWEEP_INTERVAL = int(os.environ.get('SHARE_SWEEP_INTERVAL', 3600)) # Seconds between sweeps
+    SHARE_SWEEP_BATCH = int(os.environ.get('SHARE_SWEEP_BATCH', 500))
+    SHARE_SWEEP_GRACE = int(os.environ.get('SHARE_SWEEP_GRACE', 86400)) # Keep expired links this long (410 instead of 404)
+    SHARE_SWEEP_PURGE = os.environ.get('SHARE_SWEEP_PURGE', 'False').lower() == 'true' # Purge instead of leaving tombstones
+
+    # Share access/download counters, buffered per worker and flushed in batches
+    SHARE_COUNTERS_ENABLED = os.environ.get('SHARE_COUNTERS_ENABLED', 'True').lower() == 'true'
+    SHARE_COUNTER_FLUSH_INTERVAL = int(os.environ.get('SHARE_COUNTER_FLUSH_INTERVAL', 30)) # Seconds
+    # Background flusher (started with the first request). Off: counts stay buffered until flush_counters() is called
+    SHARE_COUNTER_FLUSH_ENABLED = os.environ.get('SHARE_COUNTER_FLUSH_ENABLED', 'True').lower() == 'true'
+
+    # Share token resolution caches (per worker)
+    SHARE_CACHE_TTL = int(os.environ.get('SHARE_CACHE_TTL', 60)) # Seconds a resolved link is trusted without the DB
+    SHARE_CACHE_MAX = int(os.environ.get('SHARE_CACHE_MAX', 10000))
+    SHARE_NEGATIVE_TTL = int(os.environ.get('SHARE_NEGATIVE_TTL', 600)) # Seconds an unknown token is rejected from memory
+    SHARE_NEGATIVE_MAX = int(os.environ.get('SHARE_NEGATIVE_MAX', 100000))
+    SHARE_MISS_LIMIT = int(os.environ.get('SHARE_MISS_LIMIT', 30)) # Unknown tokens per client IP per window (request.remote_addr, see PROXY_FIX_X_FOR)
+    SHARE_MISS_WINDOW = int(os.environ.get('SHARE_MISS_WINDOW', 600))
+
+    # In-process user/team directory kept coherent via the _changes feed
+    DIRECTORY_CACHE_ENABLED = os.environ.get('DIRECTORY_CACHE_ENABLED', 'True').lower() == 'true'
+    DIRECTORY_CACHE_MAX_USERS = int(os.environ.get('DIRECTORY_CACHE_MAX_USERS', 20000))
+    DIRECTORY_CACHE_MAX_TEAMS = int(os.environ.get('DIRECTORY_CACHE_MAX_TEAMS', 5000))
+    DIRECTORY_CHANGES_POLL_TIMEOUT = int(os.environ.get('DIRECTORY_CHANGES_POLL_TIMEOUT', 30)) # Longpoll seconds
+
 
 class DevelopmentConfig(Config):
     DEBUG = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
@@ -50,6 +143,9 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     JWT_COOKIE_SECURE = False
+    DIRECTORY_CACHE_ENABLED = False # No background feed thread in tests
+    SHARE_SWEEP_ENABLED = False
+    SHARE_COUNTER_FLUSH_ENABLED = False # No CouchDB writer thread or exit-time flush in tests
     # Use a separate test database if applicable
     # DB_NAME = 'test_db'
 
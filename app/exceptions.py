@@ -21,6 +21,11 @@ class DatabaseError(ServiceError): # Or inherit directly from Exception
     def __init__(self, message="A database error occurred", status_code=500):
         super().__init__(message, status_code)
 
+class DatabasePoolTimeoutError(DatabaseError):
+    """Raised when no pooled CouchDB connection becomes free in time."""
+    def __init__(self, message="Database is busy, try again later."):
+        super().__init__(message, status_code=503)
+
 class AccessDeniedError(ServiceError):
     """Error when user lacks permission for an action."""
     def __init__(self, message="Access denied."):
@@ -103,4 +108,15 @@ class FileServiceConflictError(ConflictError, FileServiceError): # Inherit from
 class ShareExpiredError(ServiceError):
     """Specific error when a share link has expired."""
     def __init__(self, message="Share link has expired."):
-        super().__init__(message, status_code=410) # 410 Gone
\ No newline at end of file
+        super().__init__(message, status_code=410) # 410 Gone
+
+class ShareRateLimitError(ServiceError):
+    """Raised when a client has presented too many unknown share tokens."""
+    def __init__(self, message="Too many invalid share links, try again later."):
+        super().__init__(message, status_code=429) # 429 Too Many Requests
+
+class ConversionPendingError(ServiceError):
+    """Raised when a document conversion is still queued or running; poll the job for the result."""
+    def __init__(self, job_id, message="Document conversion in progress."):
+        super().__init__(message, status_code=202) # 202 Accepted
+        self.job_id = job_id
@@ -5,10 +5,14 @@ import os
 
 # Assuming UserService in app/services/user_service.py
 from app.services.user_service import user_service, UserNotFoundError, UserValidationError
+from app.services.share_service import share_service
+from app.services.file_service import file_service
+from app.services.conversion_service import conversion_service
 # Assuming TeamService might be needed if deleting users requires team checks
 # from app.services.team_service import team_service
 
-from app.utils.helpers import get_current_user_doc_and_id
+from app.extensions import db
+from app.utils.helpers import get_current_user_doc_and_id, get_identity_cache_stats, get_page_args, page_response, collect_all_pages
 from app.utils.audit import audit_event, write_audit # write_audit might be needed for manual logging
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -59,14 +63,28 @@ def download_audit_log_route():
 @admin_required
 @audit_event("get_all_users")
 def get_all_users():
+    """
+    GET /admin/users?limit=<n>&sort=<email|created_at, '-' for desc>&cursor=<next>
+    With limit or cursor: one page, {users, limit, sort, next}. Without: the full list (legacy).
+    """
+    page = get_page_args(default_sort="email", sort_fields=db.USER_SORT_INDEXES)
+    fetch_page = lambda limit, bookmark: user_service.get_users_page(
+        limit=limit, bookmark=bookmark, sort_field=page["sort_field"], descending=page["descending"])
     try:
-        users = user_service.get_all_users()
+        if page["paginated"]:
+            users, next_bookmark = fetch_page(page["limit"], page["bookmark"])
+        else:
+            users, next_bookmark = collect_all_pages(fetch_page, page), None
         # Exclude sensitive fields like password hashes before sending
         sanitized_users = [
             {k: v for k, v in user.items() if k != 'password_hash'}
             for user in users
         ]
-        return jsonify(sanitized_users), 200
+        if not page["paginated"]:
+            return jsonify(sanitized_users), 200
+        return jsonify(page_response("users", sanitized_users, next_bookmark, page)), 200
+    except UserValidationError as e:
+        raise BadRequest(str(e))
     except Exception as e:
         current_app.logger.error(f"Error fetching all users: {e}", exc_info=True)
         raise
@@ -98,4 +116,24 @@ def delete_user_route(user_id_to_delete):
         raise BadRequest(str(e))
     except Exception as e:
         current_app.logger.error(f"Error deleting user {user_id_to_delete}: {e}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+
+
+@admin_bp.route("/metrics", methods=["GET"])
+@admin_required
+def get_metrics():
+    """Per-worker runtime metrics (connection pool, caches, ...)."""
+    return jsonify({
+        "worker_pid": os.getpid(),
+        "db_pool": db.pool_stats(),
+        "identity_cache_saved_lookups": get_identity_cache_stats(), # per endpoint
+        "directory_cache": db.directory.stats(),
+        "share_token_cache": share_service.cache_stats(),
+        "share_sweeper": share_service.sweeper_stats(),
+        "share_counters": share_service.counter_stats(),
+        "content_extractor": file_service.index.extract_stats(),
+        "preview_cache": file_service.previews.stats(),
+        "conversion_cache": file_service.conversions.stats(),
+        "preview_renderers": file_service.preview_stats(),
+        "office_conversions": conversion_service.stats(),
+    }), 200
@@ -1,14 +1,18 @@
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, request, jsonify, current_app, url_for
 from flask_jwt_extended import jwt_required
 from werkzeug.exceptions import BadRequest, NotFound, Forbidden, Conflict, InternalServerError
 import werkzeug # Import werkzeug directly for exceptions
 import os
+from datetime import datetime, timezone
 
 # Assuming FileService in app/services/file_service.py
 # Import specific exceptions if defined there
 from app.services.file_service import file_service, FileServiceError, FileNotFoundError, AccessDeniedError, ConflictError
-from app.utils.helpers import resolve_target_user # Use helper for permission checks
+from app.services.conversion_service import conversion_service
+from app.exceptions import ConversionPendingError
+from app.utils.helpers import resolve_target_user, add_preview_headers, collect_all_pages # Use helper for permission checks
 from app.utils.audit import audit_event
+from app.utils.http_cache import send_cached_file
 
 files_bp = Blueprint('files', __name__, url_prefix='/files')
 
@@ -76,14 +80,15 @@ def upload_file():
 @jwt_required()
 @audit_event("download_file")
 def download_file():
-    """ GET /files/download?path=<file_path>&user_id=<optional> """
+    """ GET /files/download?path=<file_path>&user_id=<optional> - Supports Range and conditional requests. """
     try:
         target_user_id = _get_target_user_id_from_request()
         relative_path = request.args.get("path")
         if not relative_path: raise BadRequest("Missing required query parameter 'path'.")
 
         target_file, mime_type = file_service.get_file_for_download(target_user_id, relative_path)
-        return send_file(target_file, mimetype=mime_type, as_attachment=True, download_name=target_file.name)
+        return send_cached_file(target_file, mimetype=mime_type, as_attachment=True, download_name=target_file.name,
+                                cache_control=current_app.config.get('CACHE_CONTROL_DOWNLOAD', 'private, no-cache'))
     except BadRequest as e: raise e
     except FileNotFoundError as e: raise NotFound(str(e))
     except AccessDeniedError as e: raise Forbidden(str(e))
@@ -97,14 +102,31 @@ def download_file():
 @jwt_required()
 @audit_event("preview_file")
 def preview_file():
-    """ GET /files/preview?path=<file_path>&user_id=<optional> """
+    """
+    GET /files/preview?path=<file_path>&user_id=<optional>&size=<optional px>&wait=<0|1>
+    Images come back as WebP or JPEG depending on the Accept header. Simple docx
+    files may come back as HTML (DOCX_PREVIEW_MODE). Office documents still
+    converting answer 202 with a job to poll (wait=0: at once). X-Preview-Renderer
+    and Server-Timing report how the preview was produced.
+    """
     try:
         target_user_id = _get_target_user_id_from_request()
         relative_path = request.args.get("path")
         if not relative_path: raise BadRequest("Missing required query parameter 'path'.")
+        size = request.args.get("size", type=int)
 
-        file_content, mime_type = file_service.get_file_for_preview(target_user_id, relative_path)
-        return send_file(file_content, mimetype=mime_type, as_attachment=False)
+        wait = request.args.get("wait", "1") != "0"
+
+        render_info = {}
+        file_content, mime_type = file_service.get_file_for_preview(target_user_id, relative_path, size=size,
+                                                                     accept=request.headers.get("Accept", ""), wait=wait,
+                                                                     render_info=render_info)
+        response = send_cached_file(file_content, mimetype=mime_type,
+                                    cache_control=current_app.config.get('CACHE_CONTROL_PREVIEW', 'private, no-cache'))
+        response.vary.add("Accept")
+        return add_preview_headers(response, render_info)
+    except ConversionPendingError as e:
+        return _conversion_pending_response(e.job_id)
     except BadRequest as e: raise e
     except FileNotFoundError as e: raise NotFound(str(e))
     except AccessDeniedError as e: raise Forbidden(str(e))
@@ -114,6 +136,26 @@ def preview_file():
     except (NotFound, Forbidden) as e: raise e
 
 
+def _conversion_pending_response(job_id):
+    status_url = url_for("files.get_conversion_status", job_id=job_id)
+    response = jsonify({"status": "pending", "job_id": job_id, "status_url": status_url})
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    response.headers["Retry-After"] = "2"
+    return response
+
+
+@files_bp.route("/conversions/<job_id>", methods=["GET"])
+@jwt_required()
+def get_conversion_status(job_id):
+    """ GET /files/conversions/<job_id>?user_id=<optional> - Poll an office preview conversion. """
+    target_user_id = _get_target_user_id_from_request()
+    job = conversion_service.get_job(job_id)
+    if job is None or target_user_id not in job.user_ids:
+        raise NotFound("Conversion job not found.")
+    return jsonify(job.to_dict()), 200
+
+
 @files_bp.route("/rename", methods=["POST"])
 @jwt_required()
 @audit_event("rename_file_or_folder")
@@ -180,19 +222,67 @@ def delete_item():
     except (NotFound, Forbidden) as e: raise e
 
 
+def _get_search_args():
+    """
+    Parses limit/offset and the ext/min_size/max_size/modified_after/modified_before filters.
+    paginated is False when neither limit nor offset was given (legacy clients get every match).
+    """
+    default_limit = current_app.config.get("PAGE_SIZE_DEFAULT", 100)
+    max_limit = current_app.config.get("PAGE_SIZE_MAX", 1000)
+    args = {"paginated": "limit" in request.args or "offset" in request.args}
+    try:
+        args["limit"] = max(1, min(int(request.args.get("limit", default_limit)), max_limit))
+        args["offset"] = max(0, int(request.args.get("offset", 0)))
+        for key in ("min_size", "max_size"):
+            if request.args.get(key):
+                args[key] = int(request.args[key])
+    except ValueError:
+        raise BadRequest("'limit', 'offset', 'min_size' and 'max_size' must be integers.")
+    for key in ("modified_after", "modified_before"):
+        if request.args.get(key):
+            try:
+                moment = datetime.fromisoformat(request.args[key].replace("Z", "+00:00"))
+            except ValueError:
+                raise BadRequest(f"'{key}' must be an ISO 8601 date or datetime.")
+            args[key] = (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).timestamp()
+    args["extensions"] = [ext.strip() for ext in request.args.get("ext", "").split(",") if ext.strip()]
+    return args
+
+
 @files_bp.route("/search", methods=["GET"])
 @jwt_required()
 @audit_event("search_files")
 def search_files():
-    """ GET /files/search?q=<query>&user_id=<optional> """
+    """
+    GET /files/search?q=<query>&user_id=<optional>&mode=name|content
+        &limit=&offset=&ext=pdf,docx&min_size=&max_size=&modified_after=&modified_before=
+    mode=content ranks documents by their text and adds a highlighted snippet.
+    Without limit and offset every match is returned, as before pagination.
+    """
     query = request.args.get("q", "").strip()
     if not query:
         raise BadRequest("Search query parameter 'q' is required.")
+    search_args = _get_search_args()
     try:
         target_user_id = _get_target_user_id_from_request()
-        # Assuming a search method in file_service
-        matches = file_service.search_files(target_user_id, query)
-        return jsonify({"results": matches})
+        mode = request.args.get("mode", "name")
+        paginated = search_args.pop("paginated")
+
+        def fetch_page(limit, offset):
+            offset = offset or 0
+            page = file_service.search_files(target_user_id, query, mode=mode, **dict(search_args, limit=limit, offset=offset))
+            return page, (offset + len(page) if len(page) == limit else None)
+
+        if paginated:
+            matches, next_offset = fetch_page(search_args["limit"], search_args["offset"])
+        else:
+            matches, next_offset = collect_all_pages(fetch_page, search_args), None
+            search_args["limit"] = None
+        response = {"results": matches, "mode": mode, "limit": search_args["limit"], "offset": search_args["offset"],
+                    "next_offset": next_offset}
+        if mode == "content":
+            response["indexing"] = file_service.index.is_indexing(target_user_id) # Results may still be incomplete
+        return jsonify(response)
     except BadRequest as e: raise e
     except (FileNotFoundError, AccessDeniedError) as e: # e.g. user storage not found
         status_code = 404 if isinstance(e, FileNotFoundError) else 403
@@ -200,4 +290,4 @@ def search_files():
     except FileServiceError as e:
         current_app.logger.error(f"FileServiceError searching files: {e}")
         raise InternalServerError(str(e))
-    except (NotFound, Forbidden) as e: raise e
\ No newline at end of file
+    except (NotFound, Forbidden) as e: raise e
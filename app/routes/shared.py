@@ -1,17 +1,19 @@
-from flask import Blueprint, request, jsonify, send_file, current_app, url_for
+from flask import Blueprint, request, jsonify, current_app, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
-from werkzeug.exceptions import BadRequest, NotFound, Forbidden, Gone, InternalServerError
+from werkzeug.exceptions import BadRequest, NotFound, Forbidden, Gone, InternalServerError, TooManyRequests
 import werkzeug # Import werkzeug directly for exceptions
 from pathlib import Path
 import mimetypes
 
 
 # Assuming ShareService in app/services/share_service.py
-from app.services.share_service import share_service, ShareNotFoundError, ShareExpiredError, ShareAccessDeniedError, ShareValidationError
+from app.services.share_service import share_service, ShareNotFoundError, ShareExpiredError, ShareAccessDeniedError, ShareValidationError, ShareRateLimitError
 # Assuming FileService still needed to fetch the actual file based on share details
 from app.services.file_service import file_service, FileNotFoundError as FileServiceFileNotFoundError, AccessDeniedError as FileServiceAccessDeniedError
 
-from app.utils.helpers import get_current_user_doc_and_id
+from app.exceptions import ConversionPendingError
+from app.utils.helpers import get_current_user_doc_and_id, get_page_args, page_response, add_preview_headers
+from app.utils.http_cache import send_cached_file
 from app.utils.audit import audit_event, write_audit
 
 shared_bp = Blueprint('shared', __name__) # No prefix for /shared/<token> or /share
@@ -34,8 +36,10 @@ def create_share_link_route():
     target_team_id = data.get("target_team_id")
     duration_days = data.get("duration_days")
     allow_download = data.get("allow_download", True)
+    signed = data.get("signed", False) # Public only: link verified without a DB lookup
 
     if not file_path_rel: raise BadRequest("Missing 'file_path'")
+    if not isinstance(signed, bool): raise BadRequest("'signed' must be a JSON boolean")
     if share_type not in ['user', 'team', 'public']: raise BadRequest("Invalid 'share_type'")
     if share_type == 'user' and not target_email: raise BadRequest("Missing 'target_email' for user share")
     if share_type == 'team' and not target_team_id: raise BadRequest("Missing 'target_team_id' for team share")
@@ -49,7 +53,8 @@ def create_share_link_route():
             target_email=target_email,
             target_team_id=target_team_id,
             duration_days=duration_days,
-            allow_download=allow_download
+            allow_download=allow_download,
+            signed=signed
         )
 
         # Construct full URL
@@ -69,6 +74,38 @@ def create_share_link_route():
         raise
 
 
+@shared_bp.route('/share/mine', methods=['GET'])
+@jwt_required()
+@audit_event("list_my_share_links")
+def list_my_share_links_route():
+    """ GET /share/mine?limit=<n>&sort=<created_at|-created_at>&cursor=<next> """
+    caller_doc, caller_id = get_current_user_doc_and_id()
+    if not caller_doc:
+        raise NotFound("User not found.")
+    page = get_page_args(default_sort="-created_at", sort_fields=("created_at",))
+    shares, next_bookmark = share_service.list_my_shares(
+        caller_id, limit=page["limit"], bookmark=page["bookmark"], descending=page["descending"]
+    )
+    return jsonify(page_response("shares", shares, next_bookmark, page)), 200
+
+
+@shared_bp.route('/share/<string:token>', methods=['DELETE'])
+@jwt_required()
+@audit_event("revoke_share_link", target_arg="token")
+def revoke_share_link_route(token):
+    caller_doc, caller_id = get_current_user_doc_and_id()
+    if not caller_doc:
+        raise NotFound("User not found.")
+    try:
+        result = share_service.revoke_share_link(caller_id, caller_doc.get("role"), token)
+        return jsonify(result), 200
+    except ShareNotFoundError as e: raise NotFound(str(e))
+    except ShareAccessDeniedError as e: raise Forbidden(str(e))
+    except Exception as e:
+        current_app.logger.error(f"Error revoking share link {token} by {caller_id}: {e}", exc_info=True)
+        raise
+
+
 # NO @jwt_required() - public links must work initially
 @shared_bp.route('/shared/<string:token>', methods=['GET'])
 @audit_event("access_shared_file", target_arg="token", public_ok=True)
@@ -93,32 +130,68 @@ def access_shared_file_route(token):
             token=token,
             requester_id=requester_id,
             requester_email=requester_email,
-            is_authenticated=is_authenticated
+            is_authenticated=is_authenticated,
+            client_ip=request.remote_addr
         )
         # access_details should contain: owner_id, file_path_rel, allow_download
 
-        # 2. Fetch the actual file using FileService
-        # Use owner_id and relative path from the verified share details
-        file_content, mime_type = file_service.get_file_for_preview( # Use preview to handle images etc.
+        download_name = Path(access_details['file_path_rel']).name
+
+        # 2a. Download: stream the original bytes, no transcoding.
+        # Range (206, also multi-range) and conditional (ETag/Last-Modified -> 304) handling, see http_cache.
+        # ?preview=1 still renders inline even when downloads are allowed.
+        # Range continuations (resumed downloads, media seeking) don't count as new accesses
+        is_new_access = request.range is None or request.range.ranges[0][0] == 0
+
+        if access_details['allow_download'] and request.args.get("preview") != "1":
+            target_file, mime_type = file_service.get_file_for_download(
+                 user_id=access_details['owner_id'],
+                 relative_path=access_details['file_path_rel']
+            )
+            if is_new_access:
+                share_service.record_access(access_details.get('share_id'), download=True)
+            current_app.logger.info(f"Serving shared file via token {token} as original download")
+            # Link-scoped content: private, never in shared caches
+            return send_cached_file(
+                target_file,
+                mimetype=mime_type,
+                as_attachment=True,
+                download_name=download_name,
+                cache_control=current_app.config.get('CACHE_CONTROL_SHARED', 'private, no-cache'),
+            )
+
+        # 2b. Inline viewing: rendered preview (images resized, docx converted, ...)
+        render_info = {}
+        file_content, mime_type = file_service.get_file_for_preview(
              user_id=access_details['owner_id'],
-             relative_path=access_details['file_path_rel']
+             relative_path=access_details['file_path_rel'],
+             size=request.args.get("size", type=int),
+             accept=request.headers.get("Accept", ""),
+             render_info=render_info
         )
         # Note: get_file_for_preview returns path or buffer
+        if is_new_access:
+            share_service.record_access(access_details.get('share_id'), download=False)
 
-        # Determine filename for download if allowed
-        download_name = Path(access_details['file_path_rel']).name
-
-        # 3. Serve the file
-        current_app.logger.info(f"Serving shared file via token {token}, download={access_details['allow_download']}")
-        return send_file(
+        # 3. Serve the preview
+        current_app.logger.info(f"Serving shared file preview via token {token}")
+        response = send_cached_file(
             file_content,
             mimetype=mime_type,
-            as_attachment=access_details['allow_download'],
-            download_name=download_name if access_details['allow_download'] else None
+            cache_control=current_app.config.get('CACHE_CONTROL_SHARED', 'private, no-cache'),
         )
-
+        response.vary.add("Accept")
+        return add_preview_headers(response, render_info)
+
+    except ConversionPendingError:
+        # Office preview still converting: the client retries the same link
+        response = jsonify({"status": "pending"})
+        response.status_code = 202
+        response.headers["Retry-After"] = "2"
+        return response
     except ShareNotFoundError as e: raise NotFound(str(e))
     except ShareExpiredError as e: raise Gone(str(e)) # 410 Gone
+    except ShareRateLimitError as e: raise TooManyRequests(str(e))
     except ShareAccessDeniedError as e: raise Forbidden(str(e))
     except FileServiceFileNotFoundError as e:
         # File existed when link was created, but not now
@@ -5,8 +5,9 @@ from werkzeug.exceptions import BadRequest, NotFound, Forbidden
 
 # Assuming TeamService in app/services/team_service.py
 from app.exceptions import ServiceError
+from app.extensions import db
 from app.services.team_service import team_service, TeamNotFoundError, TeamAccessDeniedError, TeamValidationError
-from app.utils.helpers import get_current_user_doc_and_id
+from app.utils.helpers import get_current_user_doc_and_id, get_page_args, page_response, collect_all_pages
 from app.utils.audit import audit_event
 
 teams_bp = Blueprint('teams', __name__, url_prefix='/teams')
@@ -220,6 +221,10 @@ def delete_team(team_id):
 @jwt_required()
 @audit_event("get_all_teams")
 def get_all_teams():
+    """
+    GET /teams/all?limit=<n>&sort=<name|created_at, '-' for desc>&cursor=<next>
+    With limit or cursor: one page, {teams, limit, sort, next}. Without: the full list (legacy).
+    """
     user_doc, user_id = get_current_user_doc_and_id()
     if not user_doc:
         raise NotFound("User not found.")
@@ -232,8 +237,16 @@ def get_all_teams():
 
     try:
         # Service determines which teams to return based on user's role/status
-        teams = team_service.get_accessible_teams(user_id, user_doc.get("role"), user_doc.get("isLead"))
-        return jsonify(teams), 200
+        page = get_page_args(default_sort="name", sort_fields=db.TEAM_SORT_INDEXES)
+        fetch_page = lambda limit, bookmark: team_service.get_accessible_teams(
+            user_id, user_doc.get("role"), user_doc.get("isLead"),
+            limit=limit, bookmark=bookmark, sort_field=page["sort_field"], descending=page["descending"])
+        if not page["paginated"]:
+            return jsonify(collect_all_pages(fetch_page, page)), 200
+        teams, next_bookmark = fetch_page(page["limit"], page["bookmark"])
+        return jsonify(page_response("teams", teams, next_bookmark, page)), 200
+    except TeamValidationError as e:
+         raise BadRequest(str(e))
     except TeamAccessDeniedError as e:
          raise Forbidden(str(e)) # If service explicitly denies access
     except Exception as e:
@@ -0,0 +1,225 @@
+import fcntl
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from pathlib import Path
+
+from app.exceptions import ServiceError
+
+log = logging.getLogger(__name__)
+
+
+class ConversionJob:
+    """One office -> PDF conversion. Shared by every request for the same output key."""
+
+    def __init__(self, key, source: Path, publish):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.source = source
+        self.publish = publish
+        self.user_ids = set() # Users whose requests are attached (may poll the job)
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = Future()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "queued_s": round((self.started_at or time.time()) - self.created_at, 3),
+            "duration_s": round(self.finished_at - self.started_at, 3) if self.finished_at and self.started_at else None,
+        }
+
+
+class ConversionService:
+    """
+    Converts office documents to PDF on a bounded pool of worker threads.
+
+    Each worker owns a persistent LibreOffice user profile (claimed with a file
+    lock, so gunicorn workers on the same host never share one): profile
+    initialisation is paid once instead of per conversion, and concurrent
+    conversions can't collide on a shared profile. Requests whose key (which
+    must identify the source content) is already queued or running attach to
+    the same job. Each job has a hard timeout that kills soffice's whole
+    process group. soffice writes into a private temp dir; the caller's
+    publish callback then moves the finished PDF into place.
+    """
+
+    def __init__(self):
+        self.soffice = None
+        self.workers = 2
+        self.job_timeout = 60
+        self.request_wait = 30
+        self.profile_dir = None
+        self._queue = queue.Queue(maxsize=100)
+        self._inflight = {} # key -> queued/running job
+        self._jobs = OrderedDict() # job id -> job, recent ones kept for polling
+        self._jobs_max = 1000
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {"submitted": 0, "deduplicated": 0, "completed": 0, "failed": 0, "timed_out": 0,
+                       "rejected": 0, "convert_time_total": 0.0}
+
+    def init_app(self, app):
+        self.soffice = shutil.which("libreoffice") or shutil.which("soffice")
+        self.workers = app.config.get('OFFICE_WORKERS', 2)
+        self.job_timeout = app.config.get('OFFICE_JOB_TIMEOUT', 60)
+        self.request_wait = app.config.get('OFFICE_REQUEST_WAIT', 30)
+        self.profile_dir = Path(app.config['OFFICE_PROFILE_DIR']).resolve()
+        self._queue = queue.Queue(maxsize=app.config.get('OFFICE_QUEUE_MAX', 100))
+        if not self.soffice:
+            log.warning("LibreOffice not found, office document previews are unavailable.")
+
+    @property
+    def available(self) -> bool:
+        return self.soffice is not None
+
+    # --- Jobs ---
+
+    def submit(self, source: Path, key: str, publish, user_id=None) -> ConversionJob:
+        """
+        Queues a conversion of source (or joins the one in flight for key).
+        publish(produced_pdf_path) runs on the worker and returns the final path,
+        which becomes the job result. Raises ServiceError(503) when the queue is full.
+        """
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                self._stats["deduplicated"] += 1
+            else:
+                job = ConversionJob(key, source, publish)
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    self._stats["rejected"] += 1
+                    raise ServiceError("Document conversion queue is full, try again later.", status_code=503)
+                self._inflight[key] = job
+                self._jobs[job.id] = job
+                while len(self._jobs) > self._jobs_max:
+                    self._jobs.popitem(last=False)
+                self._stats["submitted"] += 1
+                self._ensure_workers()
+            if user_id:
+                job.user_ids.add(user_id)
+        return job
+
+    def wait(self, job: ConversionJob, timeout=None) -> Path | None:
+        """
+        Waits up to timeout seconds (default OFFICE_REQUEST_WAIT) for the job.
+        Returns the output path, None if still running, or raises ServiceError if it failed.
+        """
+        try:
+            return job.future.result(timeout=self.request_wait if timeout is None else timeout)
+        except FutureTimeoutError:
+            return None
+
+    def get_job(self, job_id) -> ConversionJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, queued=self._queue.qsize(), inflight=len(self._inflight),
+                         workers=len(self._threads), available=self.available)
+        done = stats["completed"] or 1
+        stats["convert_time_avg"] = round(stats.pop("convert_time_total") / done, 3)
+        return stats
+
+    # --- Workers ---
+
+    def _ensure_workers(self):
+        # Called with self._lock held
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._worker, name=f"office-convert-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _claim_profile(self):
+        """Claims the first free profile slot on this host; the lock is held for the thread's lifetime."""
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        slot = 0
+        while True:
+            slot_dir = self.profile_dir / f"slot-{slot}"
+            slot_dir.mkdir(exist_ok=True)
+            lock_file = open(slot_dir / ".lock", "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot_dir, lock_file
+            except BlockingIOError:
+                lock_file.close()
+                slot += 1
+
+    def _worker(self):
+        slot_dir, _lock_file = self._claim_profile()
+        profile_url = (slot_dir / "profile").as_uri()
+        log.info(f"Office conversion worker using profile {slot_dir}")
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job.status, job.started_at = "running", time.time()
+            result, error = None, None
+            try:
+                result = self._convert(job, profile_url)
+            except ServiceError as e:
+                error = e
+            except Exception as e:
+                log.error(f"❌ Unexpected error converting {job.source}: {e}", exc_info=True)
+                error = ServiceError("Office document conversion failed.", status_code=500)
+            with self._lock:
+                job.finished_at = time.time()
+                self._inflight.pop(job.key, None)
+                if error is None:
+                    job.status = "done"
+                    self._stats["completed"] += 1
+                    self._stats["convert_time_total"] += job.finished_at - job.started_at
+                else:
+                    job.status, job.error = "failed", str(error)
+                    self._stats["failed"] += 1
+            # Resolve last, so waiters and pollers see the final state
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+            self._queue.task_done()
+
+    def _convert(self, job, profile_url) -> Path:
+        with tempfile.TemporaryDirectory(prefix="office-convert-") as out_dir:
+            cmd = [self.soffice, f"-env:UserInstallation={profile_url}", "--headless", "--norestore",
+                   "--convert-to", "pdf", "--outdir", out_dir, str(job.source)]
+            log.info(f"Converting to PDF: {' '.join(cmd)}")
+            # Own process group: soffice forks soffice.bin, and a timeout must kill both
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True)
+            try:
+                stdout, stderr = proc.communicate(timeout=self.job_timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.communicate()
+                with self._lock:
+                    self._stats["timed_out"] += 1
+                log.error(f"LibreOffice conversion timed out after {self.job_timeout}s for {job.source.name}")
+                raise ServiceError("Office document conversion timed out.", status_code=504) # Gateway Timeout
+
+            produced = Path(out_dir) / f"{job.source.stem}.pdf"
+            if proc.returncode != 0 or not produced.exists():
+                log.error(f"LibreOffice conversion failed (Code {proc.returncode}) for {job.source.name}:\nSTDOUT: {stdout}\nSTDERR: {stderr}")
+                raise ServiceError("Office document conversion failed.", status_code=500)
+            output = job.publish(produced)
+        log.info(f"Successfully converted {job.source.name} to PDF in {time.time() - job.started_at:.2f}s.")
+        return output
+
+
+conversion_service = ConversionService()
@@ -2,21 +2,42 @@ from datetime import datetime, timezone
 import logging
 import os
 import io
+import hashlib
+import html
 import shutil
 import mimetypes
+import threading
+import time
 from pathlib import Path
-import subprocess
-from PIL import Image
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, features
 from werkzeug.utils import secure_filename
 # Removed: from flask import current_app
 
 # Import db instance and custom exceptions
 from app.extensions import db
+from app.utils.file_index import FileIndex, SNIPPET_START, SNIPPET_END
+from app.utils.derivative_cache import DerivativeCache
+from app.utils.directory import LRUCache
+from app.utils.docx_html import (
+    render_docx_html, ComplexDocumentError, DocxRenderError, RENDERER_VERSION as DOCX_RENDERER_VERSION
+)
 from app.exceptions import (
     FileServiceError, FileServiceFileNotFoundError as FileNotFoundError, # Use specific subclass
     FileServiceAccessDeniedError as AccessDeniedError,
-    FileServiceConflictError as ConflictError, ServiceError, ValidationError
+    FileServiceConflictError as ConflictError, ServiceError, ValidationError, ConversionPendingError
 )
+from app.services.conversion_service import conversion_service
+
+IMAGE_PREVIEW_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff"}
+
+# Preview encodings: format -> (cache suffix, mimetype, Image.save kwargs)
+PREVIEW_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", {"format": "JPEG", "quality": 85, "optimize": True}),
+    "webp": (".webp", "image/webp", {"format": "WEBP", "quality": 80, "method": 4}),
+}
+
 
 class FileService:
 
@@ -25,6 +46,20 @@ class FileService:
         self.db = db
         self.base_upload_folder = None
         self.app_logger = None # Store logger instance
+        self.index = FileIndex() # Per-user file name index used by search_files
+        self.previews = DerivativeCache() # Rendered image previews, outside the user trees
+        self.conversions = DerivativeCache() # Office documents converted to PDF, keyed by content hash
+        self._digests = LRUCache(10000) # (path, inode, mtime, size) -> sha256
+        self._complex_docx = LRUCache(10000) # digests of docx files the HTML renderer can't handle
+        self.docx_preview_mode = "pdf" # "html": render simple docx in-process, see DOCX_PREVIEW_MODE
+        self.docx_preview_max_xml_bytes = 64 * 1024 * 1024
+        self._preview_stats = {} # renderer -> counters, see preview_stats
+        self._preview_stats_lock = threading.Lock()
+        self.preview_sizes = [128, 512, 1280] # Longest edge in px, see PREVIEW_RENDITIONS
+        self.pregenerate_formats = []
+        self.preview_max_pixels = 100_000_000 # Source images above this are not previewed
+        self.preview_max_decode_bytes = 512 * 1024 * 1024 # Decoded buffer budget per preview
+        self._rendition_pool = None
 
     def init_app(self, app):
         """Configure the service with the Flask app instance."""
@@ -42,6 +77,20 @@ class FileService:
                 self.app_logger.critical(f"Configured DATABASE_FILES_DIR '{self.base_upload_folder}' exists but is not a directory.")
                 raise OSError(f"Invalid DATABASE_FILES_DIR configuration: path exists but is not a directory.")
 
+            self.index.init_app(app)
+            if app.config.get('PREVIEW_CACHE_ENABLED', True):
+                self.previews.configure(app.config['PREVIEW_CACHE_DIR'], app.config.get('PREVIEW_CACHE_MAX_BYTES', 1024 ** 3))
+            self.conversions.configure(app.config['CONVERSION_CACHE_DIR'], app.config.get('CONVERSION_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+            self.docx_preview_mode = app.config.get('DOCX_PREVIEW_MODE', self.docx_preview_mode)
+            self.docx_preview_max_xml_bytes = app.config.get('DOCX_PREVIEW_MAX_XML_BYTES', self.docx_preview_max_xml_bytes)
+            self.preview_sizes = sorted(app.config.get('PREVIEW_RENDITIONS', self.preview_sizes))
+            self.preview_max_pixels = app.config.get('PREVIEW_MAX_PIXELS', self.preview_max_pixels)
+            self.preview_max_decode_bytes = app.config.get('PREVIEW_MAX_DECODE_BYTES', self.preview_max_decode_bytes)
+            self.pregenerate_formats = [fmt for fmt in app.config.get('PREVIEW_PREGENERATE_FORMATS', [])
+                                        if fmt in PREVIEW_FORMATS and (fmt != "webp" or features.check("webp"))]
+            if self.previews.enabled and self.pregenerate_formats:
+                self._rendition_pool = ThreadPoolExecutor(max_workers=app.config.get('PREVIEW_WORKERS', 2),
+                                                          thread_name_prefix="preview-render")
             self.app_logger.info(f"FileService initialized with base folder: {self.base_upload_folder}")
 
         except KeyError:
@@ -90,6 +139,16 @@ class FileService:
         return user_root.resolve()
 
 
+    @staticmethod
+    def _missing_dirs(user_root: Path, path: Path) -> list:
+        """path plus any of its ancestors below user_root that do not exist yet (for the index)."""
+        missing = []
+        while path != user_root and not path.exists():
+            missing.append(path)
+            path = path.parent
+        return missing
+
+
     def _resolve_and_check_path(self, user_id: str, relative_path: str) -> Path:
         """Resolves a relative path against user's root and checks bounds."""
         user_root = self._get_user_root_path(user_id) # Can raise FileNotFoundError/AccessDeniedError
@@ -171,7 +230,10 @@ class FileService:
              if target_path.exists():
                   raise ConflictError("Directory or file already exists at this path.")
 
+             user_root = self._get_user_root_path(user_id)
+             created = self._missing_dirs(user_root, target_path)
              target_path.mkdir(parents=True, exist_ok=False)
+             self.index.upsert(user_id, user_root, created)
              self._log(logging.INFO, f"Created directory '{target_path}' for user {user_id}")
              return {"message": "Folder created", "path": relative_path}
         except (ConflictError, AccessDeniedError, ValidationError):
@@ -214,6 +276,8 @@ class FileService:
 
             os.rename(target_old, new_path)
             new_relative_path = str(new_path.relative_to(user_root))
+            self.index.rename(user_id, target_old.relative_to(user_root).as_posix(), new_path.relative_to(user_root).as_posix())
+            self.index.request_extraction(user_id, user_root)
             self._log(logging.INFO, f"Renamed '{target_old}' to '{new_path}' for user {user_id}")
             return {"message": "Renamed successfully", "new_path": new_relative_path}
 
@@ -255,6 +319,7 @@ class FileService:
                 self._log(logging.WARNING, f"Item exists but is not a file or directory: '{target_path}'")
                 raise ServiceError("Cannot delete item: Unknown file type.")
 
+            self.index.remove(user_id, target_path.relative_to(user_root).as_posix())
             return {"message": "Deleted successfully"}
 
         except (AccessDeniedError, ValidationError):
@@ -271,10 +336,13 @@ class FileService:
         """Saves an uploaded FileStorage object."""
         try:
             target_dir = self._resolve_and_check_path(user_id, relative_dir)
+            user_root = self._get_user_root_path(user_id)
+            created_dirs = []
 
             if not target_dir.exists():
                  # Create the target directory if it doesn't exist
                  self._log(logging.INFO, f"Creating target directory for upload: {target_dir}")
+                 created_dirs = self._missing_dirs(user_root, target_dir)
                  target_dir.mkdir(parents=True, exist_ok=True)
             elif not target_dir.is_dir():
                  raise ConflictError("Target upload path exists but is not a directory.")
@@ -303,7 +371,10 @@ class FileService:
 
             file_storage.save(str(save_path)) # Use string representation for save path
             file_size = save_path.stat().st_size
-            user_root = self._get_user_root_path(user_id)
+            self.index.upsert(user_id, user_root, created_dirs + [save_path])
+            self.index.request_extraction(user_id, user_root) # Content search text, in the background
+            if self._rendition_pool and save_path.suffix.lower() in IMAGE_PREVIEW_SUFFIXES:
+                self._rendition_pool.submit(self._pregenerate_renditions, save_path)
             saved_relative_path = str(save_path.relative_to(user_root))
 
             # Optional: Save metadata to DB (consider if needed)
@@ -339,8 +410,42 @@ class FileService:
              raise ServiceError("Could not retrieve file for download.")
 
 
-    def get_file_for_preview(self, user_id: str, relative_path: str):
-        """Gets file path and mimetype for inline preview, handling image/docx conversion."""
+    def get_file_for_preview(self, user_id: str, relative_path: str, size: int = None, accept: str = "",
+                             wait: bool = True, render_info: dict = None):
+        """
+        Gets file path and mimetype for inline preview, handling image/docx conversion.
+        Images are resized to `size` px (one of PREVIEW_RENDITIONS, default the largest)
+        and encoded as WebP when the Accept header allows it, otherwise JPEG.
+        docx files render to HTML in-process when DOCX_PREVIEW_MODE is "html" and the
+        document is simple enough. Office documents otherwise wait up to OFFICE_REQUEST_WAIT
+        for their conversion (not at all with wait=False) and raise ConversionPendingError
+        while it is still running.
+        render_info, if given, is filled with the renderer used, whether the result came
+        from cache and the time taken (for Server-Timing headers).
+        """
+        started = time.perf_counter()
+        info = {"renderer": "original", "cached": False}
+        result = self._get_preview(user_id, relative_path, size, accept, wait, info)
+        info["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        with self._preview_stats_lock:
+            stats = self._preview_stats.setdefault(info["renderer"], {"count": 0, "cached": 0, "time_total_ms": 0.0})
+            stats["count"] += 1
+            stats["cached"] += info["cached"]
+            stats["time_total_ms"] += info["duration_ms"]
+        if render_info is not None:
+            render_info.update(info)
+        return result
+
+    def preview_stats(self) -> dict:
+        """Per renderer: previews served, how many came from cache, average time."""
+        with self._preview_stats_lock:
+            return {renderer: dict(stats, time_total_ms=round(stats["time_total_ms"], 1),
+                                   time_avg_ms=round(stats["time_total_ms"] / stats["count"], 1))
+                    for renderer, stats in self._preview_stats.items()}
+
+    def _get_preview(self, user_id, relative_path, size, accept, wait, info):
+        if size is not None and size not in self.preview_sizes:
+            raise ValidationError(f"Preview size must be one of {', '.join(map(str, self.preview_sizes))}.")
         try:
             target_file = self._resolve_and_check_path(user_id, relative_path)
 
@@ -352,81 +457,64 @@ class FileService:
             file_suffix = target_file.suffix.lower()
 
             # --- Image Handling ---
-            if file_suffix in [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff"]:
+            if file_suffix in IMAGE_PREVIEW_SUFFIXES:
                 try:
-                    img = Image.open(target_file)
-                    img.load() # Load image data to catch truncated files
-
-                    # Handle transparency / palette modes for JPEG saving
-                    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
-                         background = Image.new("RGB", img.size, (255, 255, 255))
-                         img_rgba = img.convert("RGBA")
-                         background.paste(img_rgba, mask=img_rgba.split()[3])
-                         img = background
-                    elif img.mode != "RGB":
-                         img = img.convert("RGB")
-
-                    max_preview_size = (1280, 1280) # Configurable?
-                    img.thumbnail(max_preview_size, Image.Resampling.LANCZOS) # Use LANCZOS for better quality
-
-                    buffer = io.BytesIO()
-                    img.save(buffer, format="JPEG", quality=85, optimize=True) # Optimize JPEG
+                    px = size or self.preview_sizes[-1]
+                    fmt = "webp" if "image/webp" in (accept or "") and features.check("webp") else "jpeg"
+                    suffix, preview_mime, _ = PREVIEW_FORMATS[fmt]
+                    rendered = []
+                    render = lambda out: rendered.append(self._encode_preview(self._open_preview_image(target_file, px), fmt, out))
+                    cached_path = self.previews.get_or_create(
+                        DerivativeCache.path_key(target_file, target_file.stat(), f"{fmt}-{px}"), suffix, render)
+                    info["renderer"], info["cached"] = "image", cached_path is not None and not rendered
+                    if cached_path is not None:
+                        return cached_path, preview_mime # Served from disk (sendfile)
+
+                    buffer = io.BytesIO() # Cache disabled or not writable
+                    render(buffer)
                     buffer.seek(0)
-                    self._log(logging.DEBUG, f"Generated JPEG preview for '{target_file.name}'")
-                    return buffer, "image/jpeg"
+                    return buffer, preview_mime
 
+                except ServiceError:
+                    raise # Over the preview budget: never fall back to the (huge) original
                 except Exception as e:
                     self._log(logging.ERROR, f"Error processing image preview for {target_file}: {e}", exc_info=True)
                     # Fallback: Send original file, browser might handle it
                     return target_file, mime_type
 
-            # --- DOCX/DOC Handling (Requires LibreOffice) ---
+            # --- DOCX/DOC Handling (HTML in-process, or LibreOffice, see ConversionService) ---
             elif file_suffix in [".docx", ".doc"]:
-                # Check if libreoffice is available
-                soffice_cmd = shutil.which("libreoffice") or shutil.which("soffice")
-                if not soffice_cmd:
+                # Derivatives live in a content-addressed cache outside the user tree,
+                # so identical documents (any user, any name) render once
+                digest = self._content_digest(target_file)
+                key = DerivativeCache.content_key(digest, "pdf")
+                if file_suffix == ".docx" and self.docx_preview_mode == "html" and not self.conversions.contains(key, ".pdf"):
+                    html_preview = self._docx_html_preview(target_file, digest, info)
+                    if html_preview is not None:
+                        return html_preview
+
+                if not conversion_service.available:
                     self._log(logging.WARNING, f"LibreOffice not found, cannot convert {file_suffix} for preview.")
                     raise ServiceError(f"Cannot preview {file_suffix}: Office converter not installed on server.", status_code=501) # 501 Not Implemented
 
-                pdf_path = target_file.with_suffix(".pdf")
-                should_convert = True
-                if pdf_path.exists():
-                    if pdf_path.stat().st_mtime >= target_file.stat().st_mtime:
-                        should_convert = False
-
-                if should_convert:
-                    # Use subprocess for better control and error capture
-                    cmd = [soffice_cmd, '--headless', '--convert-to', 'pdf', '--outdir', str(target_file.parent), str(target_file)]
-                    self._log(logging.INFO, f"Converting to PDF: {' '.join(cmd)}")
-                    try:
-                        # Add timeout?
-                        result = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=60) # 60 sec timeout
-                        if result.returncode != 0:
-                             self._log(logging.ERROR, f"LibreOffice conversion failed (Code {result.returncode}):\nSTDOUT: {result.stdout}\nSTDERR: {result.stderr}")
-                             raise ServiceError(f"Office document conversion failed.", status_code=500)
-                        if not pdf_path.exists():
-                             self._log(logging.ERROR, f"LibreOffice conversion ran (Code 0) but PDF file '{pdf_path}' not found. Output:\n{result.stdout}\n{result.stderr}")
-                             raise ServiceError("Office document conversion output missing.", status_code=500)
-                        self._log(logging.INFO, f"Successfully converted {target_file.name} to PDF.")
-                    except subprocess.TimeoutExpired:
-                         self._log(logging.ERROR, f"LibreOffice conversion timed out for {target_file.name}")
-                         raise ServiceError("Office document conversion timed out.", status_code=504) # Gateway Timeout
-                    except Exception as e:
-                         self._log(logging.ERROR, f"Error during DOCX->PDF conversion subprocess: {e}", exc_info=True)
-                         raise ServiceError(f"Failed to convert document to PDF: {e}", status_code=500)
-
-                if pdf_path.exists():
-                    self._log(logging.DEBUG, f"Serving PDF preview for '{target_file.name}'")
-                    return pdf_path, "application/pdf"
-                else:
-                     # Should be caught above, but defensive check
-                     raise ServiceError("Failed to provide PDF preview.", status_code=500)
+                info["renderer"] = "office-pdf"
+                pdf_path = self.conversions.get(key, ".pdf")
+                info["cached"] = pdf_path is not None
+                if pdf_path is None:
+                    job = conversion_service.submit(target_file, key, user_id=user_id,
+                                                    publish=lambda produced: self.conversions.put_file(key, ".pdf", produced))
+                    pdf_path = conversion_service.wait(job, timeout=None if wait else 0)
+                    if pdf_path is None:
+                        raise ConversionPendingError(job.id)
+
+                self._log(logging.DEBUG, f"Serving PDF preview for '{target_file.name}'")
+                return pdf_path, "application/pdf"
 
             # --- Default: Send original file ---
             self._log(logging.DEBUG, f"Serving original file for preview: '{target_file.name}'")
             return target_file, mime_type
 
-        except (FileNotFoundError, AccessDeniedError):
+        except (FileNotFoundError, AccessDeniedError, ValidationError):
              raise
         except ServiceError as se: # Catch specific ServiceErrors with status codes
              raise se
@@ -435,45 +523,200 @@ class FileService:
              raise ServiceError("Could not retrieve file for preview.")
 
 
-    def search_files(self, user_id: str, query: str):
-        """Searches for files within a user's directory."""
+    def _docx_html_preview(self, source: Path, digest: str, info: dict):
+        """
+        (path or buffer, "text/html") for a docx rendered in-process, or None when the
+        document is too complex and the office converter can take it instead.
+        """
+        if self._complex_docx.get(digest) and conversion_service.available:
+            return None
+        # Without a converter, complex documents still get a best-effort rendering
+        strict = conversion_service.available
+        rendered = []
+        render = lambda out: rendered.append(render_docx_html(source, out, strict=strict, title=source.name,
+                                                              max_xml_bytes=self.docx_preview_max_xml_bytes))
+        try:
+            key = DerivativeCache.content_key(digest, f"html-{DOCX_RENDERER_VERSION}" + ("" if strict else "-lenient"))
+            preview = self.conversions.get_or_create(key, ".html", render)
+            if preview is None: # Cache not writable
+                preview = io.BytesIO()
+                render(preview)
+                preview.seek(0)
+        except ComplexDocumentError as e:
+            self._complex_docx.put(digest, True)
+            self._log(logging.DEBUG, f"'{source.name}' needs the office converter: {e}")
+            return None
+        except DocxRenderError as e:
+            if conversion_service.available:
+                return None # The converter may still make sense of it (e.g. a renamed .doc)
+            raise ServiceError(f"Cannot preview '{source.name}': {e}", status_code=422)
+        info["renderer"], info["cached"] = "docx-html", not rendered
+        self._log(logging.DEBUG, f"Serving HTML preview for '{source.name}'")
+        return preview, "text/html"
+
+
+    def _content_digest(self, source: Path) -> str:
+        """sha256 of the file, memoized per (path, inode, mtime, size)."""
+        st = source.stat()
+        memo_key = (str(source), st.st_ino, st.st_mtime_ns, st.st_size)
+        digest = self._digests.get(memo_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            self._digests.put(memo_key, digest)
+        return digest
+
+
+    def _open_preview_image(self, source: Path, max_px: int):
+        """
+        Decodes the image, flattened onto white (RGB) and scaled to fit max_px.
+        JPEGs are decoded at a reduced scale (draft) that still covers max_px;
+        other formats are shrunk with reduce() before the LANCZOS pass. Images
+        over the pixel or decode-memory budget raise a 413 ServiceError.
+        The returned image is detached from the file, whose handle is closed.
+        """
+        with Image.open(source) as original:
+            if original.width * original.height > self.preview_max_pixels:
+                raise ServiceError(f"Image is too large to preview ({original.width}x{original.height}).", status_code=413)
+
+            original.draft("RGB", (max_px, max_px)) # No-op for formats without scaled decoding
+            if original.width * original.height * 4 > self.preview_max_decode_bytes: # Pillow keeps multi-band pixels in 32 bits
+                raise ServiceError(f"Image is too large to preview ({original.width}x{original.height}).", status_code=413)
+            original.load() # Load image data to catch truncated files
+
+            # Handle transparency / palette modes; palette images can't be resampled with LANCZOS
+            has_alpha = original.mode in ("RGBA", "LA") or (original.mode == "P" and "transparency" in original.info)
+            target_mode = "RGBA" if has_alpha else "RGB"
+            img = original.convert(target_mode) if original.mode != target_mode else original.copy()
+
+        img.thumbnail((max_px, max_px), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if has_alpha:
+             background = Image.new("RGB", img.size, (255, 255, 255))
+             background.paste(img, mask=img.split()[3])
+             img = background
+        return img
+
+
+    def _encode_preview(self, img, fmt: str, out):
+        img.save(out, **PREVIEW_FORMATS[fmt][2])
+
+
+    def _pregenerate_renditions(self, source: Path):
+        """
+        Background job after an image upload: fills the preview cache with every
+        configured size and format, decoding the source once and scaling down
+        from the largest rendition to the smallest.
+        """
+        try:
+            st = source.stat()
+            needed = {(px, fmt) for px in self.preview_sizes for fmt in self.pregenerate_formats
+                      if not self.previews.contains(DerivativeCache.path_key(source, st, f"{fmt}-{px}"), PREVIEW_FORMATS[fmt][0])}
+            if not needed:
+                return
+            largest = max(px for px, _ in needed)
+            img = self._open_preview_image(source, largest)
+            for px in sorted(self.preview_sizes, reverse=True):
+                if px > largest:
+                    continue
+                img.thumbnail((px, px), Image.Resampling.LANCZOS)
+                for fmt in self.pregenerate_formats:
+                    if (px, fmt) in needed:
+                        self.previews.get_or_create(DerivativeCache.path_key(source, st, f"{fmt}-{px}"), PREVIEW_FORMATS[fmt][0],
+                                                    lambda out, fmt=fmt: self._encode_preview(img, fmt, out))
+            self._log(logging.DEBUG, f"Pre-generated {len(needed)} preview renditions for '{source.name}'")
+        except Exception as e:
+            self._log(logging.WARNING, f"Could not pre-generate previews for '{source}': {e}")
+
+
+    def search_files(self, user_id: str, query: str, limit: int = 100, offset: int = 0, extensions=None,
+                     min_size=None, max_size=None, modified_after=None, modified_before=None, mode: str = "name"):
+        """
+        Searches file names within a user's directory (case-insensitive substring),
+        or with mode="content" the text of indexed documents (see _search_content).
+        Uses the per-user file index; extensions are matched without the dot and
+        modified_after/modified_before are POSIX timestamps.
+        """
         if not query:
              raise ValidationError("Search query cannot be empty.")
-        query_lower = query.lower()
-        matches = []
+        if limit < 1 or offset < 0:
+             raise ValidationError("Invalid limit or offset.")
+        if mode not in ("name", "content"):
+             raise ValidationError("Search mode must be 'name' or 'content'.")
+        extensions = [ext.lower().lstrip('.') for ext in extensions or [] if ext.strip('.')]
+        filters = dict(extensions=extensions, min_size=min_size, max_size=max_size,
+                       modified_after=modified_after, modified_before=modified_before)
         try:
              user_root = self._get_user_root_path(user_id)
-
-             for dirpath, dirnames, filenames in os.walk(user_root):
-                 # Optional: Exclude specific directories (e.g., hidden ones)
-                 # dirnames[:] = [d for d in dirnames if not d.startswith('.')]
-                 # filenames[:] = [f for f in filenames if not f.startswith('.')]
-
-                 current_dir_path = Path(dirpath)
-                 for filename in filenames:
-                     if query_lower in filename.lower():
-                         try:
-                             full_path = current_dir_path / filename
-                             rel_path = str(full_path.relative_to(user_root))
-                             stat_res = full_path.stat()
-                             matches.append({
-                                 "name": rel_path,
-                                 "size": stat_res.st_size,
-                                 "is_directory": False,
-                                 "modified_at": datetime.fromtimestamp(stat_res.st_mtime, tz=timezone.utc).isoformat()
-                             })
-                         except OSError as e:
-                              self._log(logging.ERROR, f"Could not stat or process search match {full_path}: {e}")
-                         except ValueError as e:
-                              self._log(logging.ERROR, f"Could not get relative path for search match {full_path}: {e}")
-
-             return matches
+             if mode == "content":
+                 return self._search_content(user_id, user_root, query, limit, offset, filters)
+             rows = None
+             if self.index.enabled:
+                 try:
+                     rows = self.index.search(user_id, user_root, query, limit=limit, offset=offset, **filters)
+                 except sqlite3.Error as e:
+                     self._log(logging.ERROR, f"File index search failed for user {user_id}, walking the tree instead: {e}", exc_info=True)
+             if rows is None:
+                 rows = self._search_files_walk(user_root, query, **filters)[offset:offset + limit]
+
+             return [{
+                 "name": rel_path,
+                 "size": size,
+                 "is_directory": False,
+                 "modified_at": datetime.fromtimestamp(mtime, tz=timezone.utc).isoformat()
+             } for rel_path, size, mtime in rows]
         except (FileNotFoundError, AccessDeniedError, ValidationError): # Include user root errors
             raise
+        except ServiceError:
+            raise
         except Exception as e:
              self._log(logging.ERROR, f"Unexpected error during file search for query '{query}' user {user_id}: {e}", exc_info=True)
              raise ServiceError("An error occurred during file search.")
 
 
+    def _search_content(self, user_id: str, user_root: Path, query: str, limit: int, offset: int, filters: dict):
+        """
+        Ranked full-text search over extracted document text (txt, PDF, docx).
+        Never reads files: documents still waiting for extraction are not found yet.
+        Snippets are HTML-escaped with matches wrapped in <mark>.
+        """
+        if not (self.index.enabled and self.index.content_enabled):
+             raise ServiceError("Content search is not enabled on this server.", status_code=501)
+        self.index.request_extraction(user_id, user_root) # Picks up anything not extracted yet
+        try:
+             rows = self.index.search_content(user_id, query, limit=limit, offset=offset, **filters)
+        except sqlite3.Error as e:
+             self._log(logging.ERROR, f"Content search failed for user {user_id}: {e}", exc_info=True)
+             raise ServiceError("An error occurred during content search.")
+        return [{
+            "name": rel_path,
+            "size": size,
+            "is_directory": False,
+            "modified_at": datetime.fromtimestamp(mtime, tz=timezone.utc).isoformat(),
+            "snippet": html.escape(snippet).replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>"),
+            "score": round(-score, 6) # bm25 rank is lower-is-better
+        } for rel_path, size, mtime, snippet, score in rows]
+
+
+    def _search_files_walk(self, user_root: Path, query: str, extensions, min_size, max_size,
+                           modified_after, modified_before):
+        """Index-less search: walks the whole tree. Returns (path, size, mtime) tuples ordered by path."""
+        query_lower = query.lower()
+        matches = []
+        for rel_path, name, ext, is_dir, size, mtime in FileIndex.scan(user_root):
+            if is_dir or query_lower not in name.lower():
+                continue
+            if (extensions and ext not in extensions) \
+                    or (min_size is not None and size < min_size) or (max_size is not None and size > max_size) \
+                    or (modified_after is not None and mtime < modified_after) \
+                    or (modified_before is not None and mtime >= modified_before):
+                continue
+            matches.append((rel_path, size, mtime))
+        matches.sort()
+        return matches
+
+
 # Instantiate the service object WITHOUT calling __init__ logic needing 'app'
 file_service = FileService()
\ No newline at end of file
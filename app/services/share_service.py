@@ -1,4 +1,9 @@
+import atexit
+import random
+import re
 import secrets
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from flask import current_app
 
@@ -6,18 +11,273 @@ from flask import current_app
 from app.extensions import db
 from app.exceptions import (
     ShareNotFoundError, ShareExpiredError, ShareAccessDeniedError, ShareValidationError,
-    ServiceError, UserNotFoundError, TeamNotFoundError
+    ShareRateLimitError, ServiceError, UserNotFoundError, TeamNotFoundError
 )
+from app.utils.directory import LRUCache
+from app.utils.share_tokens import is_signed_token, sign_share_token, verify_share_token
 # Need FileService to check if file exists/is accessible by creator
 from .file_service import file_service, FileNotFoundError as FileServiceFileNotFoundError, AccessDeniedError as FileServiceAccessDeniedError
 
 
+# Anything that cannot be a token we issued is rejected before any lookup
+_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{16,128}$")
+
+# Placeholder secrets shipped in config.py/.env examples: anyone could forge signed links with them
+_KNOWN_DEFAULT_KEYS = {"default-fallback-secret-key", "default-fallback-jwt-key", "changeme", "secret"}
+_MIN_SIGNING_KEY_LENGTH = 32
+
+
 class ShareService:
 
+    def __init__(self):
+        # Replaced with configured sizes in init_app
+        self._resolved = LRUCache(10000, ttl=60) # token -> share metadata (valid links)
+        self._unknown = LRUCache(100000, ttl=600) # token -> "missing" | "expired"
+        self._misses_by_ip = LRUCache(50000, ttl=600) # client IP -> unknown tokens this window
+        self.miss_limit = 30
+        self._signing_key = None # Signed links are disabled until init_app sets the key
+        # Revoked signed links: share doc id -> expires_at (None = never); reloaded periodically
+        self._revoked = {}
+        self._revoked_refresh_at = 0.0
+        self._revocation_refresh = 60
+        self._revoked_lock = threading.Lock()
+        # Access counters buffered per worker: share doc id -> [accesses, downloads, last_accessed_at]
+        self._counters_enabled = True
+        self._pending_counts = {}
+        self._counts_lock = threading.Lock()
+        self._flusher = None
+        self._flusher_stop = threading.Event()
+        self._counter_stats = {"flushes": 0, "links_flushed": 0, "last_flush_at": None, "last_error": None}
+        self._sweeper = None
+        self._sweeper_stop = threading.Event()
+        self._background_started = False # Sweeper and counter flusher, see init_app
+        self._background_lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._sweep_stats = {
+            "runs": 0, "reclaimed_total": 0, "last_run_at": None,
+            "last_reclaimed": 0, "last_duration_s": 0.0, "last_error": None,
+        }
+
+    def init_app(self, app):
+        """Sizes the token resolution caches and sets the share signing key from config."""
+        self._resolved = LRUCache(app.config.get('SHARE_CACHE_MAX', 10000), ttl=app.config.get('SHARE_CACHE_TTL', 60))
+        self._unknown = LRUCache(app.config.get('SHARE_NEGATIVE_MAX', 100000), ttl=app.config.get('SHARE_NEGATIVE_TTL', 600))
+        self._misses_by_ip = LRUCache(50000, ttl=app.config.get('SHARE_MISS_WINDOW', 600))
+        self.miss_limit = app.config.get('SHARE_MISS_LIMIT', 30)
+        # Signed links are trusted without a DB record, so they need a dedicated, real secret
+        signing_key = app.config.get('SHARE_SIGNING_KEY')
+        if not signing_key:
+            app.logger.info("SHARE_SIGNING_KEY not set, signed share links are disabled.")
+        elif signing_key in _KNOWN_DEFAULT_KEYS or signing_key in (app.config.get('SECRET_KEY'), app.config.get('JWT_SECRET_KEY')) \
+                or len(signing_key) < _MIN_SIGNING_KEY_LENGTH:
+            raise ValueError(f"SHARE_SIGNING_KEY must be a dedicated random secret of at least {_MIN_SIGNING_KEY_LENGTH} characters.")
+        self._signing_key = signing_key.encode("utf-8") if signing_key else None
+        self._revocation_refresh = app.config.get('SHARE_REVOCATION_REFRESH', 60)
+        self._counters_enabled = app.config.get('SHARE_COUNTERS_ENABLED', True)
+        # Background threads start with the first request served, so CLI commands,
+        # a pre-fork master and test apps never spawn CouchDB writers
+        app.before_request(lambda: self._start_background_threads(app))
+
+    def _start_background_threads(self, app):
+        if self._background_started:
+            return
+        with self._background_lock:
+            if self._background_started:
+                return
+            self._background_started = True
+        if app.config.get('SHARE_SWEEP_ENABLED', True):
+            self.start_sweeper(app)
+        if self._counters_enabled and app.config.get('SHARE_COUNTER_FLUSH_ENABLED', True):
+            self.start_counter_flusher(app)
+
+    def cache_stats(self) -> dict:
+        return {
+            "resolved": self._resolved.stats(),
+            "unknown": self._unknown.stats(),
+            "clients_with_misses": len(self._misses_by_ip),
+            "revoked_signed_links": len(self._revoked),
+        }
+
+    # --- Access counters ---
+
+    def record_access(self, share_id: str | None, download: bool):
+        """Counts a share access in memory; flushed to the share doc by the counter flusher."""
+        if not self._counters_enabled or not share_id:
+            return
+        now_iso = datetime.now(timezone.utc).isoformat()
+        with self._counts_lock:
+            entry = self._pending_counts.setdefault(share_id, [0, 0, now_iso])
+            entry[0] += 1
+            if download:
+                entry[1] += 1
+            entry[2] = now_iso
+
+    def flush_counters(self) -> int:
+        """Writes buffered counts with batched _bulk_docs requests. Counts that could
+           not be written are put back for the next flush. Returns links flushed."""
+        with self._counts_lock:
+            pending, self._pending_counts = self._pending_counts, {}
+        if not pending:
+            return 0
+        error = None
+        try:
+            failed = db.add_share_link_counts({share_id: tuple(entry) for share_id, entry in pending.items()})
+        except Exception as e:
+            error = str(e)
+            failed = list(pending)
+            current_app.logger.error(f"Flushing share counters for {len(pending)} links failed: {e}")
+        if failed:
+            with self._counts_lock:
+                for share_id in failed:
+                    accesses, downloads, last = pending[share_id]
+                    entry = self._pending_counts.setdefault(share_id, [0, 0, last])
+                    entry[0] += accesses
+                    entry[1] += downloads
+                    entry[2] = max(entry[2], last)
+        written = len(pending) - len(failed)
+        self._counter_stats.update({
+            "flushes": self._counter_stats["flushes"] + 1,
+            "links_flushed": self._counter_stats["links_flushed"] + written,
+            "last_flush_at": datetime.now(timezone.utc).isoformat(),
+            "last_error": error,
+        })
+        return written
+
+    def start_counter_flusher(self, app):
+        """Starts the background thread that flushes access counters every SHARE_COUNTER_FLUSH_INTERVAL."""
+        if self._flusher and self._flusher.is_alive():
+            return
+        interval = app.config.get('SHARE_COUNTER_FLUSH_INTERVAL', 30)
+
+        def flush_in_context():
+            with app.app_context():
+                try:
+                    self.flush_counters()
+                except Exception as e:
+                    current_app.logger.error(f"Share counter flush failed: {e}", exc_info=True)
+
+        def run():
+            while not self._flusher_stop.wait(interval):
+                flush_in_context()
+
+        self._flusher = threading.Thread(target=run, name="share-counters", daemon=True)
+        self._flusher.start()
+        atexit.register(flush_in_context) # Don't lose the last interval's counts on shutdown
+
+    def counter_stats(self) -> dict:
+        with self._counts_lock:
+            pending = len(self._pending_counts)
+        return dict(self._counter_stats, pending_links=pending)
+
+    def list_my_shares(self, owner_id: str, limit: int, bookmark: str | None, descending: bool = True):
+        """One page of the owner's share links, newest first by default. Counts include
+           this worker's not yet flushed accesses. Returns (shares, next_bookmark)."""
+        try:
+            docs, next_bookmark = db.get_share_links_page(owner_id, limit=limit, bookmark=bookmark, descending=descending)
+        except Exception as e:
+            current_app.logger.error(f"Failed to list share links for {owner_id}: {e}", exc_info=True)
+            raise ServiceError("Could not retrieve share links.")
+        with self._counts_lock:
+            pending = {doc.id: list(self._pending_counts.get(doc.id, ())) for doc in docs}
+        shares = []
+        for doc in docs:
+            accesses, downloads, last = pending[doc.id] or (0, 0, None)
+            shares.append({
+                "token": doc.get("token"),
+                "file_path": doc.get("file_path"),
+                "share_type": doc.get("share_type"),
+                "allow_download": doc.get("allow_download", True),
+                "target_email": doc.get("target_email"),
+                "target_team_id": doc.get("target_team_id"),
+                "created_at": doc.get("created_at"),
+                "expires_at": doc.get("expires_at"),
+                "signed": doc.get("signed", False),
+                "revoked": doc.get("revoked", False),
+                "access_count": doc.get("access_count", 0) + accesses,
+                "download_count": doc.get("download_count", 0) + downloads,
+                "last_accessed_at": max(filter(None, [doc.get("last_accessed_at"), last]), default=None),
+            })
+        return shares, next_bookmark
+
+    # --- Expired link sweeper ---
+
+    def start_sweeper(self, app):
+        """Starts the background thread that removes expired share links."""
+        if self._sweeper and self._sweeper.is_alive():
+            return
+        interval = app.config.get('SHARE_SWEEP_INTERVAL', 3600)
+
+        def run():
+            # Jittered start so workers booted together don't sweep in lockstep
+            self._sweeper_stop.wait(random.uniform(interval * 0.1, interval * 0.5))
+            while not self._sweeper_stop.is_set():
+                with app.app_context():
+                    try:
+                        self.sweep_expired_links()
+                    except Exception as e:
+                        current_app.logger.error(f"Share sweeper run failed: {e}", exc_info=True)
+                self._sweeper_stop.wait(interval)
+
+        self._sweeper_stop.clear()
+        self._sweeper = threading.Thread(target=run, name="share-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._sweeper_stop.set()
+
+    def sweep_expired_links(self, batch_size: int | None = None) -> dict:
+        """
+        Removes share links that expired more than SHARE_SWEEP_GRACE seconds ago,
+        paging through the shares/by_expiry view oldest first, one _bulk_docs
+        (or _purge) request per batch. Returns this run's metrics.
+        """
+        config = current_app.config
+        batch_size = batch_size or config.get('SHARE_SWEEP_BATCH', 500)
+        purge = config.get('SHARE_SWEEP_PURGE', False)
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=config.get('SHARE_SWEEP_GRACE', 86400))
+
+        if not self._sweep_lock.acquire(blocking=False):
+            return {"reclaimed": 0, "skipped": "already running"}
+        started = time.monotonic()
+        reclaimed, batches, error = 0, 0, None
+        try:
+            while True:
+                expired = db.get_expired_share_links(cutoff, limit=batch_size)
+                if not expired:
+                    break
+                removed = db.remove_docs(expired, purge=purge)
+                reclaimed += removed
+                batches += 1
+                # Removed rows leave the view, so the next batch starts from the top again;
+                # stop when a batch was short or nothing could be removed (e.g. all conflicts)
+                if len(expired) < batch_size or removed == 0:
+                    break
+        except Exception as e:
+            error = str(e)
+            current_app.logger.error(f"Share sweeper stopped after {reclaimed} links: {e}", exc_info=True)
+        finally:
+            duration = time.monotonic() - started
+            self._sweep_stats.update({
+                "runs": self._sweep_stats["runs"] + 1,
+                "reclaimed_total": self._sweep_stats["reclaimed_total"] + reclaimed,
+                "last_run_at": datetime.now(timezone.utc).isoformat(),
+                "last_reclaimed": reclaimed,
+                "last_duration_s": round(duration, 3),
+                "last_error": error,
+            })
+            self._sweep_lock.release()
+        current_app.logger.info(f"Share sweeper {'purged' if purge else 'deleted'} {reclaimed} expired links "
+                                f"in {batches} batches ({duration:.2f}s).")
+        return {"reclaimed": reclaimed, "batches": batches, "duration_s": round(duration, 3), "error": error}
+
+    def sweeper_stats(self) -> dict:
+        return dict(self._sweep_stats, running=bool(self._sweeper and self._sweeper.is_alive()))
+
     def create_share_link(self, creator_id: str, relative_file_path: str, share_type: str,
                           target_email: str | None, target_team_id: str | None,
-                          duration_days: int | None, allow_download: bool):
-        """Creates a share link document in the database."""
+                          duration_days: int | None, allow_download: bool, signed: bool = False):
+        """Creates a share link document in the database.
+           signed=True (public shares only) issues a self-verifying HMAC token."""
         current_app.logger.info(f"User {creator_id} attempting to share file '{relative_file_path}' (type: {share_type})")
 
         # 1. Validate Inputs
@@ -27,6 +287,10 @@ class ShareService:
             raise ShareValidationError("Missing 'target_email' for user share.")
         if share_type == 'team' and not target_team_id:
             raise ShareValidationError("Missing 'target_team_id' for team share.")
+        if signed and share_type != 'public':
+            raise ShareValidationError("Only public shares can use signed links.")
+        if signed and not self._signing_key:
+            raise ShareValidationError("Signed share links are not configured.")
 
         # Optional: Validate email format, team existence
         if share_type == 'user':
@@ -54,8 +318,8 @@ class ShareService:
              raise ServiceError("Could not verify file access for sharing.")
 
         # 3. Generate Share Details
-        token = secrets.token_urlsafe(32)
         now = datetime.now(timezone.utc)
+        expires_at = None
         expires_at_iso = None
         if isinstance(duration_days, int) and duration_days > 0:
             try:
@@ -63,7 +327,13 @@ class ShareService:
                 expires_at_iso = expires_at.isoformat()
             except OverflowError:
                  current_app.logger.warning(f"Share duration {duration_days} days resulted in overflow, setting no expiry.")
+                 expires_at = None
                  expires_at_iso = None # Or raise validation error?
+        if signed:
+            token = sign_share_token(creator_id, relative_file_path, allow_download,
+                                     int(expires_at.timestamp()) if expires_at else None, self._signing_key)
+        else:
+            token = secrets.token_urlsafe(32)
 
         # 4. Prepare Share Document
         share_doc_data = {
@@ -78,6 +348,8 @@ class ShareService:
             # Add target info based on type
             "target_email": target_email if share_type == 'user' else None,
             "target_team_id": target_team_id if share_type == 'team' else None,
+            # Signed links are verified from the token itself; the doc is kept for listing and revocation
+            "signed": bool(signed),
         }
 
         # 5. Save to Database
@@ -85,6 +357,7 @@ class ShareService:
             doc_id, _ = db.create_share_link(share_doc_data) # Assumes this method exists
             if not doc_id:
                  raise ServiceError("Database failed to return document ID after creating share link.")
+            self._unknown.pop(token)
             current_app.logger.info(f"Share link created with token {token} (Doc ID: {doc_id}) for file '{relative_file_path}' by user {creator_id}")
             # Return key details including the token
             return {"token": token, "doc_id": doc_id, "expires_at": expires_at_iso}
@@ -93,36 +366,142 @@ class ShareService:
             raise ServiceError("Failed to save share link to database.")
 
 
-    def verify_shared_access(self, token: str, requester_id: str | None, requester_email: str | None, is_authenticated: bool):
+    def _parse_expiry(self, share: dict) -> datetime | None:
+        expires_at_str = share.get("expires_at")
+        if not expires_at_str:
+            return None
+        try:
+            # Handle potential 'Z' Zulu suffix for UTC
+            if expires_at_str.endswith('Z'):
+                expires_at_str = expires_at_str[:-1] + '+00:00'
+            expires_at = datetime.fromisoformat(expires_at_str)
+            # Ensure comparison is timezone-aware
+            if expires_at.tzinfo is None:
+                 # If stored time is naive, assume UTC? Or fail? Assume UTC for now.
+                 expires_at = expires_at.replace(tzinfo=timezone.utc)
+            return expires_at
+        except ValueError:
+            current_app.logger.error(f"Invalid expires_at format in share doc {share.get('_id')}: {expires_at_str}")
+            raise ServiceError("Invalid share link data (expiry format).") # Internal error
+
+    def _record_miss(self, client_ip: str | None):
+        if client_ip:
+            misses = self._misses_by_ip.incr(client_ip)
+            if misses == self.miss_limit:
+                current_app.logger.warning(f"Client {client_ip} reached {misses} unknown share tokens, throttling.")
+
+    def _resolve_share(self, token: str, client_ip: str | None) -> dict:
+        """
+        Share metadata for token, answered from memory where possible:
+        valid links are cached until min(SHARE_CACHE_TTL, their expiry), unknown
+        and expired tokens are remembered, and clients presenting too many unknown
+        tokens are refused before a database round-trip. Signed and cached tokens
+        never hit the database, so they are never refused.
+        """
+        if is_signed_token(token):
+            return self._resolve_signed(token, client_ip)
+
+        share = self._resolved.get(token)
+        if share is not None:
+            return share
+
+        known_bad = self._unknown.get(token)
+        if known_bad == "expired":
+            raise ShareExpiredError("This share link has expired.")
+        if known_bad or not _TOKEN_RE.match(token):
+            self._record_miss(client_ip)
+            raise ShareNotFoundError("Share link not found or invalid.")
+
+        if client_ip and (self._misses_by_ip.get(client_ip) or 0) >= self.miss_limit:
+            raise ShareRateLimitError()
+        share_doc = db.find_share_link_by_token(token) # Raises DatabaseError on lookup failure
+        if not share_doc or share_doc.get("revoked"):
+            self._unknown.put(token, "missing")
+            self._record_miss(client_ip)
+            raise ShareNotFoundError("Share link not found or invalid.")
+
+        share = dict(share_doc)
+        expires_at = self._parse_expiry(share)
+        ttl = self._resolved.ttl
+        if expires_at:
+            ttl = min(ttl, (expires_at - datetime.now(timezone.utc)).total_seconds())
+        self._resolved.put(token, share, ttl=ttl) # Expired links (ttl <= 0) are not cached here
+        return share
+
+    def _resolve_signed(self, token: str, client_ip: str | None) -> dict:
+        """Share metadata from a signed token: signature and revocation list only, no database."""
+        payload = verify_share_token(token, self._signing_key) if self._signing_key else None
+        if payload is None:
+            self._record_miss(client_ip)
+            raise ShareNotFoundError("Share link not found or invalid.")
+        doc_id = db.share_doc_id(token)
+        if self._is_revoked(doc_id):
+            raise ShareNotFoundError("Share link not found or invalid.")
+        expires_epoch = payload.get("e")
+        return {
+            "_id": doc_id,
+            "share_type": "public",
+            "owner_id": payload["o"],
+            "file_path": payload["p"],
+            "allow_download": payload.get("d", True),
+            "expires_at": datetime.fromtimestamp(expires_epoch, tz=timezone.utc).isoformat() if expires_epoch else None,
+        }
+
+    def _is_revoked(self, doc_id: str) -> bool:
+        """Checks the in-memory revocation list, reloading it from the database every
+           SHARE_REVOCATION_REFRESH seconds (one request reloads, the others use the current list)."""
+        if time.monotonic() >= self._revoked_refresh_at and self._revoked_lock.acquire(blocking=False):
+            try:
+                self._revoked_refresh_at = time.monotonic() + self._revocation_refresh
+                now = datetime.now(timezone.utc)
+                revoked = {}
+                for share in db.get_revoked_share_links():
+                    expires_at = self._parse_expiry(share)
+                    if expires_at is None or expires_at > now: # Expired links fail anyway
+                        revoked[share["_id"]] = expires_at
+                self._revoked = revoked
+            except Exception as e:
+                # Keep serving with the last known list; signed links must not depend on CouchDB
+                current_app.logger.error(f"Could not reload share revocation list: {e}")
+            finally:
+                self._revoked_lock.release()
+        return doc_id in self._revoked
+
+    def revoke_share_link(self, requester_id: str, requester_role: str | None, token: str):
+        """Revokes a share link early (owner or admin). Other workers pick it up within
+           SHARE_CACHE_TTL (database links) or SHARE_REVOCATION_REFRESH (signed links)."""
+        share_doc = db.find_share_link_by_token(token)
+        if not share_doc or share_doc.get("revoked"):
+            raise ShareNotFoundError("Share link not found or invalid.")
+        if share_doc.get("owner_id") != requester_id and requester_role != "admin":
+            current_app.logger.warning(f"User {requester_id} denied revoking share {share_doc.get('_id')} owned by {share_doc.get('owner_id')}")
+            raise ShareAccessDeniedError("Only the owner or an admin can revoke this share link.")
+
+        db.revoke_share_link(share_doc)
+        self._resolved.pop(token)
+        self._unknown.put(token, "missing")
+        if share_doc.get("signed"):
+            self._revoked[share_doc["_id"]] = self._parse_expiry(share_doc)
+        current_app.logger.info(f"Share link {share_doc.get('_id')} revoked by {requester_id}")
+        return {"message": "Share link revoked."}
+
+    def verify_shared_access(self, token: str, requester_id: str | None, requester_email: str | None,
+                             is_authenticated: bool, client_ip: str | None = None):
         """
         Verifies a share token, checks expiry and permissions.
         Returns share details needed to fetch the file if access is granted.
         """
         current_app.logger.debug(f"Verifying access for share token {token}. Requester ID: {requester_id}, Email: {requester_email}, Auth: {is_authenticated}")
 
-        share_doc = db.find_share_link_by_token(token) # Assumes this method exists
-        if not share_doc:
-            raise ShareNotFoundError("Share link not found or invalid.")
+        share_doc = self._resolve_share(token, client_ip)
 
         # Check Expiry
-        expires_at_str = share_doc.get("expires_at")
-        if expires_at_str:
-            try:
-                # Handle potential 'Z' Zulu suffix for UTC
-                if expires_at_str.endswith('Z'):
-                    expires_at_str = expires_at_str[:-1] + '+00:00'
-                expires_at = datetime.fromisoformat(expires_at_str)
-                # Ensure comparison is timezone-aware
-                if expires_at.tzinfo is None:
-                     # If stored time is naive, assume UTC? Or fail? Assume UTC for now.
-                     expires_at = expires_at.replace(tzinfo=timezone.utc)
-
-                if datetime.now(timezone.utc) > expires_at:
-                    current_app.logger.warning(f"Share link expired for token: {token} (Expired at: {expires_at_str})")
-                    raise ShareExpiredError("This share link has expired.")
-            except ValueError:
-                current_app.logger.error(f"Invalid expires_at format in share doc {share_doc.id}: {expires_at_str}")
-                raise ServiceError("Invalid share link data (expiry format).") # Internal error
+        expires_at = self._parse_expiry(share_doc)
+        if expires_at and datetime.now(timezone.utc) > expires_at:
+            current_app.logger.warning(f"Share link expired for token: {token} (Expired at: {share_doc.get('expires_at')})")
+            self._resolved.pop(token)
+            self._unknown.put(token, "expired")
+            raise ShareExpiredError("This share link has expired.")
 
         # Check Permissions based on share_type
         share_type = share_doc.get("share_type")
@@ -151,7 +530,7 @@ class ShareService:
             else:
                 current_app.logger.warning(f"Team share access denied for token {token}. Requester not authenticated or missing ID/target team.")
         else:
-            current_app.logger.error(f"Invalid share_type '{share_type}' encountered in share doc {share_doc.id} for token {token}")
+            current_app.logger.error(f"Invalid share_type '{share_type}' encountered in share doc {share_doc.get('_id')} for token {token}")
             raise ServiceError("Invalid share link type encountered.")
 
         if not access_granted:
@@ -163,10 +542,11 @@ class ShareService:
         allow_download = share_doc.get("allow_download", True)
 
         if not owner_id or not file_path_rel:
-             current_app.logger.error(f"Share doc {share_doc.id} (token {token}) is missing owner_id or file_path.")
+             current_app.logger.error(f"Share doc {share_doc.get('_id')} (token {token}) is missing owner_id or file_path.")
              raise ServiceError("Incomplete share link data found.")
 
         return {
+            "share_id": share_doc.get("_id"),
             "owner_id": owner_id,
             "file_path_rel": file_path_rel,
             "allow_download": allow_download
@@ -2,7 +2,6 @@
 
 import couchdb
 from flask import current_app
-from datetime import datetime, timezone # Needed for overview calculation
 
 # Import db instance and custom exceptions
 from app.extensions import db
@@ -10,6 +9,7 @@ from app.exceptions import (
     TeamNotFoundError, TeamAccessDeniedError, TeamValidationError,
     UserNotFoundError, ServiceError
 )
+from app.utils.helpers import forget_current_user
 # Import logging if you need it directly (though current_app.logger is preferred)
 import logging
 
@@ -75,6 +75,7 @@ class TeamService:
                  # Update the Lead User's Status
                  try:
                      update_success = db.set_user_lead_status(lead_user_id, True)
+                     forget_current_user(lead_user_id)
                      if not update_success:
                           # db.set_user_lead_status logs errors internally now
                           current_app.logger.warning(f"Team '{team_name}' created, but failed to set isLead=true for user {lead_user_id}.")
@@ -139,6 +140,7 @@ class TeamService:
         # Database.edit_team should handle lookups, updates, lead status changes
         try:
             updated_doc_id, _ = db.edit_team(**edit_args) # Use keyword arguments
+            forget_current_user() # Lead changes rewrite the old and new lead's user docs
 
             if not updated_doc_id:
                  # This might happen if edit_team returns None/False on no changes or error
@@ -208,60 +210,26 @@ class TeamService:
              current_app.logger.warning(f"Denied overview access for team {team_id}: User {requestor_id} not admin or lead.")
              raise TeamAccessDeniedError("Only admins or the team lead can view the team overview.")
 
-        # Fetch projects & tasks (requires these methods in Database class)
+        # Counts and duration totals come pre-aggregated from the team_stats view
         try:
-            # These methods should return lists of documents (or dicts)
-            projects = db.get_projects_by_team(team_id)
-            tasks = db.get_tasks_by_team(team_id)
-            current_app.logger.debug(f"Team {team_id} overview: Found {len(projects)} projects, {len(tasks)} tasks.")
+            stats = db.get_team_stats(team_id)
+            current_app.logger.debug(f"Team {team_id} overview: {stats['projects']} projects, "
+                                     f"{stats['open_tasks'] + stats['completed_tasks']} tasks.")
         except Exception as e:
-             current_app.logger.error(f"Failed to fetch projects/tasks for team overview {team_id}: {e}", exc_info=True)
+             current_app.logger.error(f"Failed to fetch project/task stats for team overview {team_id}: {e}", exc_info=True)
              raise ServiceError("Could not retrieve project/task data for team overview.")
 
-        # Calculate stats (copied logic from original route)
-        open_tasks = [t for t in tasks if isinstance(t, dict) and not t.get("completed", False)]
-        completed_tasks = [t for t in tasks if isinstance(t, dict) and t.get("completed", False)]
-
-        durations_minutes = []
-        for t in completed_tasks:
-            try:
-                # Ensure timestamps are valid ISO strings and handle potential timezone issues
-                start_str = t.get("created_at")
-                end_str = t.get("completed_at")
-                if not start_str or not end_str: continue # Skip if timestamps missing
-
-                start = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
-                end = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
-
-                # Ensure both are offset-aware or offset-naive before subtraction
-                # Assuming ISO format implies offset-aware (often UTC)
-                if start.tzinfo is None or end.tzinfo is None:
-                     # Log warning if timezone info inconsistent or missing
-                     current_app.logger.debug(f"Task {t.get('id','N/A')} has naive timestamp(s), assuming UTC for duration calculation.")
-                     start = start.replace(tzinfo=timezone.utc) if start.tzinfo is None else start
-                     end = end.replace(tzinfo=timezone.utc) if end.tzinfo is None else end
-
-                # Ensure end time is after start time
-                if end > start:
-                    duration = (end - start).total_seconds()
-                    if duration >= 0:
-                        durations_minutes.append(duration / 60.0)
-                else:
-                     current_app.logger.warning(f"Task {t.get('id','N/A')} completed_at is not after created_at. Skipping duration.")
-
-            except (KeyError, ValueError, TypeError) as e:
-                current_app.logger.warning(f"Could not calculate duration for task {t.get('id','N/A')} in team {team_id}: {e}")
-                continue # Skip task if timestamps invalid
-
-        avg_minutes = sum(durations_minutes) / len(durations_minutes) if durations_minutes else 0.0
-        current_app.logger.debug(f"Team {team_id} overview calculation: Avg completion {avg_minutes:.2f} mins from {len(durations_minutes)} tasks.")
+        # Only completed tasks with valid created_at < completed_at count towards the average
+        duration_count = stats["duration_count"]
+        avg_minutes = stats["duration_minutes_total"] / duration_count if duration_count else 0.0
+        current_app.logger.debug(f"Team {team_id} overview calculation: Avg completion {avg_minutes:.2f} mins from {duration_count} tasks.")
 
         return {
             "teamId": team_id, # Use the input team_id
             "teamName": team.get("name", "Unknown"), # Use fetched name
-            "projectCount": len(projects),
-            "openTasksCount": len(open_tasks),
-            "completedTasksCount": len(completed_tasks),
+            "projectCount": stats["projects"],
+            "openTasksCount": stats["open_tasks"],
+            "completedTasksCount": stats["completed_tasks"],
             "avgCompletionTimeMinutes": round(avg_minutes, 2), # Round for cleaner output
         }
 
@@ -274,6 +242,7 @@ class TeamService:
         # Call database method which handles finding, deleting, and lead status update
         try:
             delete_success = db.delete_team(team_id_to_delete) # db method returns bool
+            forget_current_user() # The former lead's isLead may have been cleared
             if not delete_success:
                  # This likely means team wasn't found or internal DB error occurred
                  # db.delete_team should log specifics, raise NotFoundError here
@@ -315,29 +284,36 @@ class TeamService:
             # Re-raise as a ServiceError or return empty list depending on desired handling
             raise ServiceError("Could not retrieve teams associated with the user.")
 
-    def get_accessible_teams(self, user_id: str, user_role: str, is_lead: bool | None):
-        """Gets teams accessible to the user based on role/status."""
+    def get_accessible_teams(self, user_id: str, user_role: str, is_lead: bool | None,
+                             limit: int = 100, bookmark: str | None = None,
+                             sort_field: str = "name", descending: bool = False):
+        """
+        Gets one page of teams accessible to the user based on role/status.
+        Returns (teams, next_bookmark); next_bookmark is None on the last page.
+        """
         # Ensure is_lead is treated as boolean
         is_actually_lead = is_lead is True
 
         if user_role == "admin":
-            current_app.logger.debug(f"Fetching all teams for admin user {user_id}")
+            current_app.logger.debug(f"Fetching teams page for admin user {user_id}")
             try:
-                 # Database method should return populated list
-                 return db.get_all_teams()
+                 # Database method returns a populated page
+                 return db.get_teams_page(limit=limit, bookmark=bookmark, sort_field=sort_field, descending=descending)
+            except ValueError as ve: # Unsupported sort field
+                 raise TeamValidationError(str(ve))
             except Exception as e:
-                 current_app.logger.error(f"Failed to get all teams for admin {user_id}: {e}", exc_info=True)
+                 current_app.logger.error(f"Failed to get teams page for admin {user_id}: {e}", exc_info=True)
                  raise ServiceError("Could not retrieve list of all teams.")
 
         elif is_actually_lead:
             current_app.logger.debug(f"Fetching teams led by user {user_id} (isLead=True)")
-            # Reuse existing method
-            return self.get_teams_led_by_user(user_id)
+            # A lead's own teams are a small set, returned as a single page
+            return self.get_teams_led_by_user(user_id), None
         else:
             # Regular users (workers) or leads not marked as such
             current_app.logger.info(f"User {user_id} (role: {user_role}, lead: {is_actually_lead}) requesting team list - returning empty list (no permission).")
             # No access for non-admin/non-lead to the "all teams" style list in this implementation
-            return [] # Return empty list
+            return [], None # Return empty page
 
 
     def is_user_lead_of_any_team(self, user_id: str, exclude_team_id: str | None = None) -> bool:
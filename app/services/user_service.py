@@ -5,6 +5,7 @@ from flask import current_app
 # Import db instance and custom exceptions
 from app.extensions import db
 from app.exceptions import UserNotFoundError, ServiceError, UserValidationError
+from app.utils.helpers import forget_current_user
 
 class UserService:
 
@@ -18,6 +19,16 @@ class UserService:
             current_app.logger.error(f"Failed to retrieve all users: {e}", exc_info=True)
             raise ServiceError("Could not retrieve user list.")
 
+    def get_users_page(self, limit: int, bookmark: str | None, sort_field: str = "email", descending: bool = False):
+        """Retrieves one page of users. Returns (users, next_bookmark)."""
+        try:
+            return db.get_users_page(limit=limit, bookmark=bookmark, sort_field=sort_field, descending=descending)
+        except ValueError as ve: # Unsupported sort field
+            raise UserValidationError(str(ve))
+        except Exception as e:
+            current_app.logger.error(f"Failed to retrieve users page: {e}", exc_info=True)
+            raise ServiceError("Could not retrieve user list.")
+
     def find_user(self, user_id=None, email=None):
         """Finds a single user by ID or email."""
         if user_id:
@@ -59,6 +70,7 @@ class UserService:
         # 3. Delete the user document
         try:
             delete_success = db.delete_user(user_id_to_delete) # Assumes this method exists and deletes the doc
+            forget_current_user(user_id_to_delete)
             if not delete_success:
                  # This might mean the user was already gone somehow
                  current_app.logger.warning(f"db.delete_user returned false for {user_id_to_delete}, user might have been deleted concurrently.")
@@ -0,0 +1,231 @@
+# app/utils/couch_pool.py
+
+import socket
+import threading
+import time
+import weakref
+from http.client import HTTPConnection, HTTPSConnection
+
+import couchdb
+from couchdb import util
+
+from app.exceptions import DatabasePoolTimeoutError
+
+
+class _SplitTimeoutMixin:
+    """Applies separate connect and read timeouts to an HTTP(S) connection.
+    http.client only knows one timeout, so the socket is re-armed after connect.
+    Also used when http.client transparently reconnects a closed connection."""
+
+    read_timeout = None
+
+    def connect(self):
+        super().connect()
+        if self.sock is not None:
+            self.sock.settimeout(self.read_timeout)
+            # Let the kernel detect dead peers on long-idle pooled sockets
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+class PooledHTTPConnection(_SplitTimeoutMixin, HTTPConnection):
+    pass
+
+
+class PooledHTTPSConnection(_SplitTimeoutMixin, HTTPSConnection):
+    pass
+
+
+class BoundedConnectionPool:
+    """
+    Drop-in replacement for couchdb.http.ConnectionPool.
+
+    The stock pool never limits how many sockets are open and keeps every
+    released connection forever. This one caps concurrent connections per
+    (scheme, host), makes callers wait (up to `pool_timeout`) when the cap is
+    reached, drops idle connections older than `keepalive_idle` and records
+    usage metrics.
+    """
+
+    def __init__(self, maxsize=10, connect_timeout=5.0, read_timeout=20.0,
+                 keepalive_idle=60.0, pool_timeout=10.0, disable_ssl_verification=False):
+        self.maxsize = max(1, int(maxsize))
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_idle = keepalive_idle
+        self.pool_timeout = pool_timeout
+        self.disable_ssl_verification = disable_ssl_verification
+
+        self._idle = {}  # (scheme, host) -> list of (conn, released_at)
+        # Leased connections are tracked weakly: couchdb.Session does not release
+        # a connection after a socket error, so a leaked lease frees its slot once
+        # the connection object is garbage collected.
+        self._leased = {}  # (scheme, host) -> WeakSet of connections
+        self._cond = threading.Condition()
+
+        self._stats = {
+            "created": 0, "reused": 0, "released": 0, "expired": 0,
+            "waits": 0, "wait_time_total": 0.0, "wait_time_max": 0.0, "timeouts": 0,
+        }
+
+    # couchdb.Session reads this attribute when it builds a pool itself
+    @property
+    def timeout(self):
+        return self.read_timeout
+
+    def configure(self, maxsize=None, connect_timeout=None, read_timeout=None,
+                  keepalive_idle=None, pool_timeout=None):
+        """Update pool settings in place (e.g. from Flask config in init_app)."""
+        with self._cond:
+            if maxsize is not None: self.maxsize = max(1, int(maxsize))
+            if connect_timeout is not None: self.connect_timeout = connect_timeout
+            if read_timeout is not None: self.read_timeout = read_timeout
+            if keepalive_idle is not None: self.keepalive_idle = keepalive_idle
+            if pool_timeout is not None: self.pool_timeout = pool_timeout
+            # Idle sockets carry the old timeouts, let them be re-created
+            stale = [conn for conns in self._idle.values() for conn, _ in conns]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in stale:
+            conn.close()
+
+    def _new_connection(self, scheme, host):
+        if scheme == 'http':
+            conn = PooledHTTPConnection(host, timeout=self.connect_timeout)
+        elif scheme == 'https':
+            context = None
+            if self.disable_ssl_verification:
+                import ssl
+                context = ssl._create_unverified_context()
+            conn = PooledHTTPSConnection(host, timeout=self.connect_timeout, context=context)
+        else:
+            raise ValueError('%s is not a supported scheme' % scheme)
+        conn.read_timeout = self.read_timeout
+        conn.connect()
+        return conn
+
+    def get(self, url):
+        scheme, host = util.urlsplit(url, 'http', False)[:2]
+        key = (scheme, host)
+        conn = None
+        waited = None
+
+        with self._cond:
+            leased = self._leased.setdefault(key, weakref.WeakSet())
+            idle = self._idle.setdefault(key, [])
+            deadline = None
+            while len(leased) >= self.maxsize:
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.pool_timeout
+                    waited = now
+                    self._stats["waits"] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise DatabasePoolTimeoutError(
+                        f"Timed out after {self.pool_timeout}s waiting for a CouchDB connection "
+                        f"({len(leased)}/{self.maxsize} in use).")
+                # Short slices so slots freed by garbage collection are noticed
+                self._cond.wait(min(remaining, 0.05))
+
+            if waited is not None:
+                wait_time = time.monotonic() - waited
+                self._stats["wait_time_total"] += wait_time
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+
+            expired = []
+            now = time.monotonic()
+            while idle:
+                candidate, released_at = idle.pop()
+                if self.keepalive_idle is not None and now - released_at > self.keepalive_idle:
+                    expired.append(candidate)
+                    continue
+                conn = candidate
+                break
+            self._stats["expired"] += len(expired)
+            if conn is not None:
+                self._stats["reused"] += 1
+                leased.add(conn)
+            else:
+                # Hold the slot with a placeholder while connecting outside the lock
+                placeholder = _Reservation()
+                leased.add(placeholder)
+
+        for stale in expired:
+            stale.close()
+
+        if conn is None:
+            try:
+                conn = self._new_connection(scheme, host)
+            finally:
+                with self._cond:
+                    self._leased[key].discard(placeholder)
+                    if conn is not None:
+                        self._leased[key].add(conn)
+                        self._stats["created"] += 1
+                    self._cond.notify()
+        return conn
+
+    def release(self, url, conn):
+        scheme, host = util.urlsplit(url, 'http', False)[:2]
+        key = (scheme, host)
+        close_conn = False
+        with self._cond:
+            self._leased.setdefault(key, weakref.WeakSet()).discard(conn)
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.monotonic()))
+            else:
+                close_conn = True
+            self._stats["released"] += 1
+            self._cond.notify()
+        if close_conn:
+            conn.close()
+
+    def stats(self) -> dict:
+        """Returns a snapshot of pool usage counters."""
+        with self._cond:
+            in_use = sum(len(leased) for leased in self._leased.values())
+            idle = sum(len(conns) for conns in self._idle.values())
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "maxsize": self.maxsize,
+                "in_use": in_use,
+                "idle": idle,
+                "wait_time_avg": (snapshot["wait_time_total"] / snapshot["waits"]) if snapshot["waits"] else 0.0,
+            })
+        return snapshot
+
+    def close(self):
+        with self._cond:
+            conns = [conn for idle in self._idle.values() for conn, _ in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class _Reservation:
+    """Weak-referenceable placeholder holding a pool slot while connecting."""
+    pass
+
+
+class PooledSession(couchdb.Session):
+    """couchdb.Session that uses a BoundedConnectionPool."""
+
+    def __init__(self, maxsize=10, connect_timeout=5.0, read_timeout=20.0,
+                 keepalive_idle=60.0, pool_timeout=10.0, **kwargs):
+        super().__init__(timeout=read_timeout, **kwargs)
+        self.connection_pool = BoundedConnectionPool(
+            maxsize=maxsize, connect_timeout=connect_timeout, read_timeout=read_timeout,
+            keepalive_idle=keepalive_idle, pool_timeout=pool_timeout)
+
+    def disable_ssl_verification(self):
+        self._disable_ssl_verification = True
+        self.connection_pool.disable_ssl_verification = True
+        self.connection_pool.close()
@@ -0,0 +1,193 @@
+# app/utils/derivative_cache.py
+
+import os
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+
+class DerivativeCache:
+    """
+    On-disk cache for files derived from user files (previews, thumbnails, ...).
+
+    Entries are keyed by source version and rendition: either (path, mtime,
+    size) via path_key, or a content digest via content_key so identical files
+    share one entry. Editing or replacing the source simply misses and the old
+    entry ages out. Writes go to a temp file in the target directory and are
+    published with os.replace, so readers never see partial files. The
+    directory is bounded by a byte
+    budget; each entry's mtime doubles as its LRU clock (refreshed on hits)
+    and the oldest entries are evicted first. Safe to share between worker
+    processes: eviction re-reads the directory instead of trusting counters.
+    """
+
+    def __init__(self):
+        self.cache_dir = None
+        self.enabled = False
+        self.max_bytes = 1024 ** 3
+        self._bytes = None # Estimated size on disk, None until first scanned
+        self._lock = threading.Lock()
+        self._render_locks = {} # key -> lock, so concurrent misses render once
+        self.stats_counters = {"hits": 0, "misses": 0, "writes": 0, "write_errors": 0, "evictions": 0}
+
+    def configure(self, cache_dir, max_bytes):
+        """Enables the cache in cache_dir (None disables it) with a budget of max_bytes."""
+        self.enabled = bool(cache_dir)
+        if not self.enabled:
+            return
+        self.cache_dir = Path(cache_dir).resolve()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def path_key(source: Path, st: os.stat_result, rendition: str) -> str:
+        raw = f"{source}\0{st.st_mtime_ns}\0{st.st_size}\0{rendition}".encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    @staticmethod
+    def content_key(digest: str, rendition: str) -> str:
+        return hashlib.sha256(f"{digest}\0{rendition}".encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str, suffix: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{suffix}"
+
+    def get(self, key: str, suffix: str):
+        """Path of the cached derivative, or None."""
+        if not self.enabled:
+            return None
+        path = self._entry_path(key, suffix)
+        try:
+            os.utime(path) # LRU touch (atime is unreliable with noatime mounts)
+        except FileNotFoundError:
+            self.stats_counters["misses"] += 1
+            return None
+        except OSError as e:
+            log.warning(f"Derivative cache touch failed for {path}: {e}")
+        self.stats_counters["hits"] += 1
+        return path
+
+    def contains(self, key: str, suffix: str) -> bool:
+        """Whether the derivative is cached (no LRU touch, no stats)."""
+        return self.enabled and self._entry_path(key, suffix).exists()
+
+    def get_or_create(self, key: str, suffix: str, render):
+        """
+        Returns the cached derivative path, calling render(file_obj) to write it
+        on a miss. Returns None if the cache is disabled or the write failed;
+        exceptions raised by render propagate.
+        """
+        if not self.enabled:
+            return None
+        path = self.get(key, suffix)
+        if path is not None:
+            return path
+        path = self._entry_path(key, suffix)
+        with self._lock:
+            render_lock = self._render_locks.setdefault(path.name, threading.Lock())
+        try:
+            with render_lock:
+                if path.exists(): # Rendered by another request while we waited
+                    return path
+                return self._write(path, render)
+        finally:
+            with self._lock:
+                self._render_locks.pop(path.name, None)
+
+    def _write(self, path: Path, render):
+        try:
+            path.parent.mkdir(exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        except OSError as e:
+            self.stats_counters["write_errors"] += 1
+            log.error(f"❌ Could not create derivative cache entry {path}: {e}")
+            return None
+        try:
+            with os.fdopen(fd, "wb") as out:
+                render(out) # Errors from rendering propagate to the caller
+            size = os.path.getsize(tmp_name)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+        self.stats_counters["writes"] += 1
+        self._account(size)
+        return path
+
+    def put_file(self, key: str, suffix: str, produced: Path) -> Path:
+        """Moves an already rendered file (e.g. converter output) into the cache."""
+        path = self._entry_path(key, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        os.close(fd)
+        try:
+            shutil.move(str(produced), tmp_name) # Copies when the cache is on another filesystem
+            size = os.path.getsize(tmp_name)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+        self.stats_counters["writes"] += 1
+        self._account(size)
+        return path
+
+    # --- Budget ---
+
+    def _scan(self):
+        """(mtime, size, path) for every entry, ignoring in-progress temp files."""
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue # Evicted by another worker
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _account(self, added):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._bytes += added
+            if self._bytes <= self.max_bytes:
+                return
+            self.evict()
+
+    def evict(self, target_ratio=0.9):
+        """Removes least recently used entries until the cache is below target_ratio of the budget."""
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * target_ratio
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._bytes = total
+        self.stats_counters["evictions"] += removed
+        if removed:
+            log.info(f"Derivative cache evicted {removed} entries, {total} bytes remain in {self.cache_dir}.")
+
+    def stats(self) -> dict:
+        return dict(self.stats_counters, enabled=self.enabled, bytes=self._bytes, max_bytes=self.max_bytes)
@@ -0,0 +1,395 @@
+# app/utils/directory.py
+
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+import couchdb
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU mapping with an optional eviction callback.
+    With a ttl (seconds, default for every entry or per put) entries also
+    expire: expired entries read as missing and are purged before live ones
+    are evicted. on_evict is only called for entries evicted to make room.
+    """
+
+    def __init__(self, maxsize, on_evict=None, ttl=None):
+        self.maxsize = max(1, int(maxsize))
+        self.on_evict = on_evict
+        self.ttl = ttl
+        self._data = OrderedDict() # key -> (value, expires_at or None)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0: # Already expired: drop any stale entry instead
+            self.pop(key)
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + ttl if ttl is not None else None)
+            self._data.move_to_end(key)
+            evicted = self._make_room(now)
+        self._notify_evicted(evicted)
+
+    def incr(self, key, amount=1) -> int:
+        """Increments a counter entry. A new counter starts a fresh TTL window,
+           increments keep the window's original expiry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[1] is not None and entry[1] <= now):
+                entry = (0, now + self.ttl if self.ttl is not None else None)
+            value = entry[0] + amount
+            self._data[key] = (value, entry[1])
+            self._data.move_to_end(key)
+            evicted = self._make_room(now)
+        self._notify_evicted(evicted)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def items(self):
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._data.items()
+                    if expires_at is None or expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _make_room(self, now):
+        # Called with self._lock held
+        if len(self._data) > self.maxsize and self.ttl is not None:
+            for key in [key for key, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+                del self._data[key]
+        evicted = []
+        while len(self._data) > self.maxsize:
+            old_key, (old_value, _) = self._data.popitem(last=False)
+            evicted.append((old_key, old_value))
+        self.evictions += len(evicted)
+        return evicted
+
+    def _notify_evicted(self, evicted):
+        if self.on_evict:
+            for old_key, old_value in evicted:
+                self.on_evict(old_key, old_value)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+class ChangesFollower:
+    """
+    Follows the CouchDB _changes feed (longpoll) in a daemon thread and hands
+    every change row (with include_docs) to the registered listeners.
+    Uses its own HTTP session so the long-poll never holds a pooled connection.
+    With a selector only matching documents are sent (server-side _selector filter).
+    """
+
+    def __init__(self, server_url, db_name, poll_timeout=30, batch_limit=500):
+        self.server_url = server_url
+        self.db_name = db_name
+        self.poll_timeout = poll_timeout
+        self.batch_limit = batch_limit
+        self.listeners = []
+        self.last_seq = None
+        self.on_start = None # Optional callable(feed_db) run once before following (warm-up)
+        self.selector = None # Optional Mango selector for the _changes filter
+        self._healthy_until = 0.0
+        self._caught_up = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="couchdb-changes", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_healthy(self) -> bool:
+        """True while polls keep succeeding (no missed changes can be pending)."""
+        return time.monotonic() < self._healthy_until
+
+    def _mark_healthy(self):
+        # A longpoll returns at the latest after poll_timeout; allow some slack
+        self._healthy_until = time.monotonic() + self.poll_timeout + 10
+
+    def _connect(self):
+        session = couchdb.Session(timeout=self.poll_timeout + 15)
+        return couchdb.Server(self.server_url, session=session)[self.db_name]
+
+    def _run(self):
+        backoff = 1
+        feed_db = None
+        while not self._stop.is_set():
+            try:
+                if feed_db is None:
+                    feed_db = self._connect()
+                if self.last_seq is None:
+                    # Take the sequence BEFORE warming, so changes made while
+                    # loading are replayed afterwards; only commit it once the
+                    # warm-up succeeded, so a failed one is retried
+                    start_seq = feed_db.info().get("update_seq", "now")
+                    if self.on_start:
+                        self.on_start(feed_db)
+                    self.last_seq = start_seq
+                    log.info(f"Changes follower starting from seq {str(self.last_seq)[:20]}...")
+
+                # Catch up with plain polls first, then block on longpoll
+                filter_args = {"filter": "_selector", "_selector": {"selector": self.selector}} if self.selector else {}
+                data = feed_db.changes(
+                    feed="longpoll" if self._caught_up else "normal",
+                    since=self.last_seq, include_docs=True,
+                    timeout=int(self.poll_timeout * 1000), limit=self.batch_limit, **filter_args
+                )
+                results = data.get("results", [])
+                for change in results:
+                    for listener in self.listeners:
+                        try:
+                            listener(change)
+                        except Exception as le:
+                            log.error(f"Changes listener failed for {change.get('id')}: {le}", exc_info=True)
+                self.last_seq = data.get("last_seq", self.last_seq)
+                self._caught_up = len(results) < self.batch_limit
+                if self._caught_up:
+                    self._mark_healthy()
+                backoff = 1
+            except Exception as e:
+                self._healthy_until = 0.0
+                feed_db = None
+                log.warning(f"Changes feed error, retrying in {backoff}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+class UserTeamDirectory:
+    """
+    In-process, bounded (LRU) copy of user and team documents.
+
+    Kept coherent by a ChangesFollower; while the feed is not healthy every
+    lookup returns None so callers fall back to the database. Cached documents
+    are handed out as shallow copies.
+    """
+
+    # Only users, teams and deletions (tombstones carry no type) reach the follower,
+    # not the share, counter and job docs every other write produces
+    CHANGES_SELECTOR = {"$or": [{"type": {"$in": ["user", "team"]}}, {"_deleted": True}]}
+
+    def __init__(self, max_users=20000, max_teams=5000):
+        self.users = LRUCache(max_users, on_evict=self._on_user_evicted)
+        self.teams = LRUCache(max_teams)
+        self.lead_teams = LRUCache(max_teams) # lead_id -> tuple of team ids (complete list)
+        self._emails = {} # email -> user id
+        self._lock = threading.Lock()
+        self._generation = 0 # Bumped on every invalidation, guards fills racing a change
+        self._warm = False
+        self.follower = None
+        self.hits = 0
+        self.misses = 0
+
+    # --- Lifecycle ---
+
+    def attach(self, follower: ChangesFollower):
+        self.follower = follower
+        follower.add_listener(self.apply_change)
+        follower.on_start = self.warm
+        follower.selector = self.CHANGES_SELECTOR
+        follower.start()
+
+    def is_active(self) -> bool:
+        return self._warm and self.follower is not None and self.follower.is_healthy()
+
+    def warm(self, feed_db):
+        """Loads users and teams (up to capacity) into the cache."""
+        started = time.monotonic()
+        user_docs = list(feed_db.find({"selector": {"type": "user"}, "limit": self.users.maxsize}))
+        for doc in user_docs:
+            self._put_user(doc)
+        team_docs = list(feed_db.find({"selector": {"type": "team"}, "limit": self.teams.maxsize + 1}))
+        for doc in team_docs[:self.teams.maxsize]:
+            self.teams.put(doc.id, doc)
+        if len(team_docs) <= self.teams.maxsize:
+            # Complete view of all teams, so per-lead lists are complete too
+            by_lead = {}
+            for doc in team_docs:
+                if doc.get("lead_id"):
+                    by_lead.setdefault(doc["lead_id"], []).append(doc.id)
+            for lead_id, team_ids in by_lead.items():
+                self.lead_teams.put(lead_id, tuple(team_ids))
+        self._warm = True
+        log.info(f"Directory warmed with {len(user_docs)} users and {len(team_docs)} teams "
+                 f"in {time.monotonic() - started:.2f}s.")
+
+    # --- Change handling ---
+
+    def generation(self) -> int:
+        return self._generation
+
+    def invalidate(self, doc_id):
+        """Drops a document (and anything derived from it) from the cache."""
+        with self._lock:
+            self._generation += 1
+        old_user = self.users.pop(doc_id)
+        if old_user is not None:
+            self._forget_email(old_user.get("email"), doc_id)
+        old_team = self.teams.pop(doc_id)
+        if old_team is not None and old_team.get("lead_id"):
+            self.lead_teams.pop(old_team["lead_id"])
+        for lead_id, team_ids in self.lead_teams.items():
+            if doc_id in team_ids:
+                self.lead_teams.pop(lead_id)
+
+    def apply_change(self, change):
+        doc_id = change.get("id")
+        if not doc_id or doc_id.startswith("_design/"):
+            return
+        doc = change.get("doc")
+        doc_type = doc.get("type") if doc else None
+        if not change.get("deleted") and doc_type not in ("user", "team"):
+            return
+        self.invalidate(doc_id)
+        if change.get("deleted") or not doc:
+            return
+        doc = couchdb.Document(doc)
+        if doc_type == "user":
+            self._put_user(doc)
+        else:
+            self.teams.put(doc_id, doc)
+            if doc.get("lead_id"):
+                self.lead_teams.pop(doc["lead_id"])
+
+    # --- Lookups (None means "ask the database") ---
+
+    def get_user(self, user_id):
+        if not self.is_active():
+            return None
+        doc = self.users.get(user_id)
+        self._count(doc is not None)
+        return couchdb.Document(doc) if doc is not None else None
+
+    def get_user_by_email(self, email):
+        if not self.is_active() or not email:
+            return None
+        user_id = self._emails.get(email)
+        doc = self.users.get(user_id) if user_id else None
+        if doc is not None and doc.get("email") != email:
+            doc = None # Stale email mapping
+        self._count(doc is not None)
+        return couchdb.Document(doc) if doc is not None else None
+
+    def get_team(self, team_id):
+        if not self.is_active():
+            return None
+        doc = self.teams.get(team_id)
+        self._count(doc is not None)
+        return couchdb.Document(doc) if doc is not None else None
+
+    def get_teams_by_lead(self, lead_id):
+        """Returns the full list of team docs led by lead_id, or None if unknown."""
+        if not self.is_active():
+            return None
+        team_ids = self.lead_teams.get(lead_id)
+        docs = []
+        if team_ids is not None:
+            for team_id in team_ids:
+                doc = self.teams.get(team_id)
+                if doc is None:
+                    team_ids = None # Partially evicted, treat as miss
+                    break
+                docs.append(couchdb.Document(doc))
+        self._count(team_ids is not None)
+        return docs if team_ids is not None else None
+
+    # --- Fills after a database miss ---
+
+    def put_user(self, doc, since_generation):
+        if self.is_active() and doc is not None and since_generation == self._generation:
+            self._put_user(couchdb.Document(doc))
+
+    def put_team(self, doc, since_generation):
+        if self.is_active() and doc is not None and since_generation == self._generation:
+            self.teams.put(doc.id, couchdb.Document(doc))
+
+    def put_teams_by_lead(self, lead_id, docs, since_generation):
+        if not self.is_active() or since_generation != self._generation:
+            return
+        for doc in docs:
+            self.teams.put(doc.id, couchdb.Document(doc))
+        self.lead_teams.put(lead_id, tuple(doc.id for doc in docs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "active": self.is_active(),
+            "users": len(self.users),
+            "teams": len(self.teams),
+            "lead_lists": len(self.lead_teams),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "last_seq": str(self.follower.last_seq)[:40] if self.follower else None,
+        }
+
+    # --- Internals ---
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _put_user(self, doc):
+        self.users.put(doc.id, doc)
+        if doc.get("email"):
+            with self._lock:
+                self._emails[doc["email"]] = doc.id
+
+    def _forget_email(self, email, user_id):
+        with self._lock:
+            if email and self._emails.get(email) == user_id:
+                del self._emails[email]
+
+    def _on_user_evicted(self, user_id, doc):
+        self._forget_email(doc.get("email"), user_id)
@@ -0,0 +1,213 @@
+# app/utils/docx_html.py
+"""
+Lightweight docx -> HTML rendering for previews of simple documents.
+
+Covers paragraphs, headings, bold/italic/underline/strike runs, hyperlinks,
+lists and tables, which is most of what people write in Word. Anything that
+would be lost (images, text boxes, equations, embedded objects, footnotes)
+makes the document "complex": strict rendering raises ComplexDocumentError so
+the caller can fall back to the office converter.
+"""
+
+import html
+import zipfile
+from xml.etree import ElementTree
+
+RENDERER_VERSION = "2" # Part of the cache key: bump when the output changes
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+R_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+M_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/math}"
+
+# Elements whose content this renderer can't show faithfully
+COMPLEX_TAGS = {
+    f"{W_NS}drawing", f"{W_NS}pict", f"{W_NS}object", f"{W_NS}txbxContent", f"{W_NS}altChunk",
+    f"{W_NS}footnoteReference", f"{W_NS}endnoteReference", f"{M_NS}oMath", f"{M_NS}oMathPara",
+}
+RUN_FORMATS = [("b", "strong"), ("i", "em"), ("u", "u"), ("strike", "s")]
+LINK_SCHEMES = ("http://", "https://", "mailto:")
+OUTLINE_HEADING_LEVELS = {str(level) for level in range(9)} # outlineLvl 9 means body text
+ALIGNMENTS = {"center": "center", "right": "right", "end": "right", "both": "justify"}
+
+PAGE_HEAD = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<style>
+body{{font-family:Calibri,Arial,sans-serif;line-height:1.4;max-width:50em;margin:2em auto;padding:0 1em;color:#222}}
+p{{margin:0 0 .6em}}table{{border-collapse:collapse;margin:0 0 1em}}td{{border:1px solid #999;padding:.2em .4em;vertical-align:top}}
+td p{{margin:0}}
+</style></head><body>
+"""
+
+
+class DocxRenderError(Exception):
+    """The file is not a readable docx document."""
+
+
+class ComplexDocumentError(DocxRenderError):
+    """The document uses features this renderer can't show (images, text boxes, equations, ...)."""
+
+
+def render_docx_html(path, out, strict: bool = True, title: str = "", max_xml_bytes: int = 64 * 1024 * 1024):
+    """
+    Streams an HTML rendering of the docx at path into the binary file object out.
+    strict=True raises ComplexDocumentError on unsupported content, otherwise it is skipped.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            if archive.getinfo("word/document.xml").file_size > max_xml_bytes:
+                raise ComplexDocumentError("Document body is too large for the HTML renderer.")
+            links = _read_links(archive)
+            list_formats = _read_list_formats(archive)
+            out.write(PAGE_HEAD.format(title=html.escape(title)).encode("utf-8"))
+            with archive.open("word/document.xml") as document:
+                _render_body(document, out, links, list_formats, strict)
+            out.write(b"</body></html>\n")
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise DocxRenderError(f"Not a readable docx file: {e}") from e
+
+
+def _read_links(archive) -> dict:
+    """Relationship id -> external hyperlink target (only schemes safe to link to)."""
+    try:
+        rels = ElementTree.fromstring(archive.read("word/_rels/document.xml.rels"))
+    except KeyError:
+        return {}
+    return {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{REL_NS}Relationship")
+            if rel.get("TargetMode") == "External" and (rel.get("Target") or "").lower().startswith(LINK_SCHEMES)}
+
+
+def _read_list_formats(archive) -> dict:
+    """numId -> {ilvl: "ul" | "ol"} from word/numbering.xml."""
+    try:
+        numbering = ElementTree.fromstring(archive.read("word/numbering.xml"))
+    except KeyError:
+        return {}
+    abstract = {}
+    for definition in numbering.iter(f"{W_NS}abstractNum"):
+        levels = {}
+        for level in definition.iter(f"{W_NS}lvl"):
+            fmt = level.find(f"{W_NS}numFmt")
+            levels[level.get(f"{W_NS}ilvl")] = "ul" if fmt is None or fmt.get(f"{W_NS}val") == "bullet" else "ol"
+        abstract[definition.get(f"{W_NS}abstractNumId")] = levels
+    formats = {}
+    for num in numbering.iter(f"{W_NS}num"):
+        ref = num.find(f"{W_NS}abstractNumId")
+        if ref is not None:
+            formats[num.get(f"{W_NS}numId")] = abstract.get(ref.get(f"{W_NS}val"), {})
+    return formats
+
+
+def _render_body(document, out, links, list_formats, strict):
+    open_list = None # "ul"/"ol" while consecutive list paragraphs are being written
+    table_tags = {f"{W_NS}tbl": "table", f"{W_NS}tr": "tr", f"{W_NS}tc": "td"}
+    # iterparse keeps memory flat: every paragraph is written and cleared as soon as it ends
+    for event, element in ElementTree.iterparse(document, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag in COMPLEX_TAGS and strict:
+                raise ComplexDocumentError(f"Unsupported element {tag.split('}')[-1]}.")
+            if tag in table_tags:
+                if open_list:
+                    out.write(f"</{open_list}>\n".encode())
+                    open_list = None
+                out.write(f"<{table_tags[tag]}>".encode())
+            continue
+
+        if tag in table_tags:
+            if open_list:
+                out.write(f"</{open_list}>\n".encode())
+                open_list = None
+            out.write(f"</{table_tags[tag]}>\n".encode())
+            element.clear()
+        elif tag == f"{W_NS}p":
+            block, list_tag = _paragraph(element, links, list_formats)
+            if list_tag != open_list:
+                if open_list:
+                    out.write(f"</{open_list}>\n".encode())
+                if list_tag:
+                    out.write(f"<{list_tag}>\n".encode())
+                open_list = list_tag
+            out.write(block.encode("utf-8"))
+            element.clear()
+    if open_list:
+        out.write(f"</{open_list}>\n".encode())
+
+
+def _paragraph(p, links, list_formats):
+    """(html, list tag or None) for one w:p element."""
+    tag, style, list_tag = "p", "", None
+    props = p.find(f"{W_NS}pPr")
+    if props is not None:
+        style_id = props.find(f"{W_NS}pStyle")
+        style_name = style_id.get(f"{W_NS}val", "") if style_id is not None else ""
+        outline = props.find(f"{W_NS}outlineLvl")
+        if style_name == "Title":
+            tag = "h1"
+        elif style_name.startswith("Heading") and style_name[7:].isdigit():
+            tag = f"h{min(int(style_name[7:]), 6)}"
+        elif outline is not None and outline.get(f"{W_NS}val", "") in OUTLINE_HEADING_LEVELS:
+            tag = f"h{min(int(outline.get(f'{W_NS}val')) + 1, 6)}"
+
+        numbering = props.find(f"{W_NS}numPr")
+        if numbering is not None and tag == "p":
+            num_id = numbering.find(f"{W_NS}numId")
+            level = numbering.find(f"{W_NS}ilvl")
+            num_id = num_id.get(f"{W_NS}val") if num_id is not None else None
+            level = level.get(f"{W_NS}val", "0") if level is not None else "0"
+            if not level.isdigit(): # Malformed ilvl: render as a top level item
+                level = "0"
+            if num_id and num_id != "0": # numId 0 means "numbering removed"
+                tag, list_tag = "li", list_formats.get(num_id, {}).get(level, "ul")
+                if level != "0":
+                    style = f"margin-left:{int(level) * 1.5:g}em;"
+
+        align = props.find(f"{W_NS}jc")
+        if align is not None and align.get(f"{W_NS}val") in ALIGNMENTS:
+            style += f"text-align:{ALIGNMENTS[align.get(f'{W_NS}val')]};"
+
+    content = "".join(_inline(p, links)) or "<br>" # Empty paragraphs still take up a line
+    style_attr = f' style="{style}"' if style else ""
+    return f"<{tag}{style_attr}>{content}</{tag}>\n", list_tag
+
+
+def _inline(parent, links):
+    for child in parent:
+        tag = child.tag
+        if tag == f"{W_NS}r":
+            yield _run(child)
+        elif tag == f"{W_NS}hyperlink":
+            target = links.get(child.get(f"{R_NS}id"))
+            inner = "".join(_inline(child, links))
+            yield f'<a href="{html.escape(target)}" rel="noopener noreferrer">{inner}</a>' if target else inner
+        elif tag in (f"{W_NS}del", f"{W_NS}pPr", f"{W_NS}rPr"):
+            continue # Tracked deletions are not part of the current text
+        else:
+            yield from _inline(child, links) # w:ins, w:smartTag, w:sdt, w:fldSimple, ...
+
+
+def _run(run):
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == f"{W_NS}t":
+            parts.append(html.escape(child.text or ""))
+        elif tag == f"{W_NS}tab":
+            parts.append("&emsp;")
+        elif tag in (f"{W_NS}br", f"{W_NS}cr"):
+            parts.append("<br>")
+        elif tag == f"{W_NS}noBreakHyphen":
+            parts.append("&#8209;")
+    text = "".join(parts)
+    props = run.find(f"{W_NS}rPr")
+    if not text or props is None:
+        return text
+    for prop, element in RUN_FORMATS:
+        flag = props.find(f"{W_NS}{prop}")
+        if flag is not None and flag.get(f"{W_NS}val", "true") not in ("0", "false", "none"):
+            text = f"<{element}>{text}</{element}>"
+    vertical = props.find(f"{W_NS}vertAlign")
+    if vertical is not None and vertical.get(f"{W_NS}val") in ("superscript", "subscript"):
+        element = "sup" if vertical.get(f"{W_NS}val") == "superscript" else "sub"
+        text = f"<{element}>{text}</{element}>"
+    return text
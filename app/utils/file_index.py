@@ -0,0 +1,448 @@
+# app/utils/file_index.py
+
+import os
+import sqlite3
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+
+from app.utils.text_extract import ExtractionError, extract_text, supported_extensions
+
+log = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,      -- relative to the user root, '/' separated
+    name TEXT NOT NULL,
+    ext TEXT NOT NULL DEFAULT '',   -- lower case, without the dot
+    is_dir INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_ext ON entries (ext);
+CREATE INDEX IF NOT EXISTS entries_size ON entries (size);
+CREATE INDEX IF NOT EXISTS entries_mtime ON entries (mtime);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Trigram full-text index over file names (SQLite >= 3.34). Only a rename
+# changes `name`, so moving a directory does not touch it for the children.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(name, content='entries', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE OF name ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO entries_fts (rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+# Extracted document text, keyed by entries.id (renames keep the ID, so they keep
+# the text); `extracted` records which size/mtime the text belongs to
+CONTENT_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5(body, tokenize='unicode61 remove_diacritics 2');
+CREATE TABLE IF NOT EXISTS extracted (id INTEGER PRIMARY KEY, size INTEGER, mtime REAL NOT NULL, error TEXT);
+CREATE TRIGGER IF NOT EXISTS entries_ad_contents AFTER DELETE ON entries BEGIN
+    DELETE FROM contents WHERE rowid = old.id;
+    DELETE FROM extracted WHERE id = old.id;
+END;
+"""
+
+UPSERT_SQL = (
+    "INSERT INTO entries (path, name, ext, is_dir, size, mtime) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (path) DO UPDATE SET name = excluded.name, ext = excluded.ext, "
+    "is_dir = excluded.is_dir, size = excluded.size, mtime = excluded.mtime"
+)
+
+# Trigram MATCH needs at least three characters; shorter queries use LIKE
+FTS_MIN_QUERY = 3
+
+# snippet() markers, swapped for <mark> tags once the snippet has been HTML-escaped
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+
+
+def _subtree_range(rel_path):
+    """Bounds covering every path below rel_path ('/' is 0x2F, '0' is 0x30)."""
+    return rel_path + "/", rel_path + "0"
+
+
+def _row_for(rel_path, is_dir, size, mtime):
+    name = rel_path.rsplit("/", 1)[-1]
+    ext = "" if is_dir else os.path.splitext(name)[1][1:].lower()
+    return rel_path, name, ext, 1 if is_dir else 0, None if is_dir else size, mtime
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _content_match(query):
+    """Every whitespace-separated term must occur (each quoted, so no FTS5 operators)."""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+def _filter_clauses(extensions, min_size, max_size, modified_after, modified_before):
+    where, params = [], []
+    if extensions:
+        where.append(f"e.ext IN ({', '.join('?' * len(extensions))})")
+        params.extend(extensions)
+    for clause, value in (("e.size >= ?", min_size), ("e.size <= ?", max_size),
+                          ("e.mtime >= ?", modified_after), ("e.mtime < ?", modified_before)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    return where, params
+
+
+class FileIndex:
+    """
+    Per-user SQLite index of file names and metadata (size, mtime, extension).
+
+    FileService keeps it current on every write it performs; an index that
+    was never built, or was invalidated after a failed update, is rebuilt by
+    walking the user's tree on the next search. Changes made to the storage
+    directory behind the service's back are found by verify().
+
+    Document text for content search is extracted by a background thread per
+    worker process: whatever files have no text for their current size/mtime
+    are pending, so a restart (or a second worker) just picks up the rest.
+    """
+
+    def __init__(self):
+        self.index_dir = None
+        self.enabled = False
+        self.busy_timeout = 10
+        self._fts = None # Whether this SQLite build has the trigram tokenizer
+        self._content = None # Whether it has FTS5 at all (content search)
+        self._build_locks = {}
+        self._locks_guard = threading.Lock()
+        self.content_enabled = False
+        self.content_max_chars = 1_000_000
+        self.content_max_bytes = 50 * 1024 * 1024
+        self.content_batch = 50
+        self._pending = OrderedDict() # user_id -> user_root, waiting for the extractor
+        self._extracting = None
+        self._pending_lock = threading.Lock()
+        self._pending_event = threading.Event()
+        self._extractor = None
+        self._extract_stats = {"extracted": 0, "failed": 0, "skipped_large": 0, "last_error": None}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('FILE_INDEX_ENABLED', True)
+        if not self.enabled:
+            log.info("File name index disabled, searches will walk the storage tree.")
+            return
+        self.index_dir = Path(app.config['FILE_INDEX_DIR']).resolve()
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.busy_timeout = app.config.get('FILE_INDEX_BUSY_TIMEOUT', 10)
+        self.content_enabled = app.config.get('CONTENT_INDEX_ENABLED', True)
+        self.content_max_chars = app.config.get('CONTENT_INDEX_MAX_CHARS', self.content_max_chars)
+        self.content_max_bytes = app.config.get('CONTENT_INDEX_MAX_FILE_BYTES', self.content_max_bytes)
+        self.content_batch = app.config.get('CONTENT_INDEX_BATCH', self.content_batch)
+
+    # --- Connections ---
+
+    def _db_path(self, user_id) -> Path:
+        return self.index_dir / f"{user_id}.sqlite3"
+
+    def _connect(self, user_id):
+        conn = sqlite3.connect(str(self._db_path(user_id)), timeout=self.busy_timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        if self._fts is not False:
+            try:
+                conn.executescript(FTS_SCHEMA)
+                self._fts = True
+            except sqlite3.OperationalError as e:
+                log.warning(f"SQLite trigram tokenizer unavailable ({e}), file search falls back to LIKE.")
+                self._fts = False
+        if self._content is not False:
+            try:
+                conn.executescript(CONTENT_SCHEMA)
+                self._content = True
+            except sqlite3.OperationalError as e:
+                log.warning(f"SQLite FTS5 unavailable ({e}), content search is disabled.")
+                self._content = False
+        return conn
+
+    def _build_lock(self, user_id):
+        with self._locks_guard:
+            return self._build_locks.setdefault(user_id, threading.Lock())
+
+    # --- Incremental updates (never raise; a failed update invalidates the index) ---
+
+    def upsert(self, user_id, user_root: Path, paths):
+        """Indexes (or refreshes) the given absolute paths below user_root."""
+        if not self.enabled:
+            return
+        try:
+            rows = []
+            for path in paths:
+                st = path.stat()
+                rows.append(_row_for(path.relative_to(user_root).as_posix(), path.is_dir(), st.st_size, st.st_mtime))
+            with closing(self._connect(user_id)) as conn, conn:
+                conn.executemany(UPSERT_SQL, rows)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            self._update_failed(user_id, "upsert", e)
+
+    def remove(self, user_id, rel_path):
+        """Drops rel_path and, for directories, everything below it."""
+        if not self.enabled:
+            return
+        low, high = _subtree_range(rel_path)
+        try:
+            with closing(self._connect(user_id)) as conn, conn:
+                conn.execute("DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)", (rel_path, low, high))
+        except sqlite3.Error as e:
+            self._update_failed(user_id, "remove", e)
+
+    def rename(self, user_id, old_rel, new_rel):
+        """Moves an entry and its subtree to a new path, keeping row IDs."""
+        if not self.enabled:
+            return
+        old_low, old_high = _subtree_range(old_rel)
+        new_low, new_high = _subtree_range(new_rel)
+        _, name, ext, _, _, _ = _row_for(new_rel, False, None, 0)
+        try:
+            with closing(self._connect(user_id)) as conn, conn:
+                # Stale rows at the destination would violate the unique path
+                conn.execute("DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)", (new_rel, new_low, new_high))
+                if self._content:
+                    # A new extension may mean a different extractor (or none): extract again
+                    for table, column in (("contents", "rowid"), ("extracted", "id")):
+                        conn.execute(f"DELETE FROM {table} WHERE {column} IN "
+                                     f"(SELECT id FROM entries WHERE path = ? AND is_dir = 0 AND ext != ?)", (old_rel, ext))
+                conn.execute("UPDATE entries SET path = ?, name = ?, ext = CASE WHEN is_dir THEN '' ELSE ? END WHERE path = ?",
+                             (new_rel, name, ext, old_rel))
+                conn.execute("UPDATE entries SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?",
+                             (new_rel, len(old_rel) + 1, old_low, old_high))
+        except sqlite3.Error as e:
+            self._update_failed(user_id, "rename", e)
+
+    def invalidate(self, user_id):
+        """Marks the index as unbuilt so the next search rebuilds it."""
+        try:
+            with closing(self._connect(user_id)) as conn, conn:
+                conn.execute("DELETE FROM meta WHERE key = 'built_at'")
+        except sqlite3.Error as e:
+            log.error(f"❌ Could not invalidate file index for user {user_id}, removing it: {e}")
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(f"{self._db_path(user_id)}{suffix}")
+                except OSError:
+                    pass
+
+    def _update_failed(self, user_id, operation, error):
+        log.error(f"❌ File index {operation} failed for user {user_id}, index will be rebuilt: {error}")
+        self.invalidate(user_id)
+
+    # --- Rebuild / verify ---
+
+    @staticmethod
+    def scan(user_root: Path):
+        """Walks user_root (skipping symlinks) and yields index rows."""
+        stack = [(str(user_root), "")]
+        while stack:
+            abs_dir, rel_dir = stack.pop()
+            try:
+                with os.scandir(abs_dir) as it:
+                    for entry in it:
+                        if entry.is_symlink():
+                            continue
+                        rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        try:
+                            is_dir = entry.is_dir()
+                            st = entry.stat()
+                        except OSError as e:
+                            log.warning(f"File index scan skipped '{entry.path}': {e}")
+                            continue
+                        yield _row_for(rel, is_dir, st.st_size, st.st_mtime)
+                        if is_dir:
+                            stack.append((entry.path, rel))
+            except OSError as e:
+                log.warning(f"File index scan could not list '{abs_dir}': {e}")
+
+    def rebuild(self, user_id, user_root: Path) -> dict:
+        """
+        Brings the user's index in line with a fresh scan, in one transaction.
+        Unchanged files keep their rows, and with them any extracted text.
+        """
+        started = time.monotonic()
+        result = self._sync(user_id, user_root, apply=True)
+        duration = round(time.monotonic() - started, 3)
+        log.info(f"Rebuilt file index for user {user_id}: {result['on_disk']} entries in {duration}s.")
+        return {"entries": result["on_disk"], "duration_s": duration}
+
+    def verify(self, user_id, user_root: Path, repair=False) -> dict:
+        """Compares the index with the tree on disk and optionally applies the difference."""
+        result = self._sync(user_id, user_root, apply=repair)
+        result["repaired"] = bool(repair)
+        return result
+
+    def _sync(self, user_id, user_root, apply):
+        on_disk = {row[0]: row for row in self.scan(user_root)}
+        with self._build_lock(user_id), closing(self._connect(user_id)) as conn:
+            indexed = {row[0]: row for row in conn.execute("SELECT path, name, ext, is_dir, size, mtime FROM entries")}
+            missing = [row for path, row in on_disk.items() if path not in indexed]
+            # Directory mtimes move with every child change and are not searched, so only files can be stale
+            stale = [row for path, row in on_disk.items()
+                     if path in indexed and indexed[path] != row and not (row[3] and indexed[path][3])]
+            orphaned = [(path,) for path in indexed if path not in on_disk]
+            built = conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is not None
+            if apply and (missing or stale or orphaned or not built):
+                with conn:
+                    conn.executemany("DELETE FROM entries WHERE path = ?", orphaned)
+                    conn.executemany(UPSERT_SQL, missing + stale)
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(time.time()),))
+        return {"on_disk": len(on_disk), "indexed": len(indexed), "missing": len(missing), "stale": len(stale),
+                "orphaned": len(orphaned), "built": built}
+
+    # --- Content extraction ---
+
+    def request_extraction(self, user_id, user_root: Path):
+        """Queues the user for the background extractor (cheap; safe to call on every write)."""
+        if not (self.enabled and self.content_enabled) or self._content is False:
+            return
+        with self._pending_lock:
+            self._pending[user_id] = user_root
+            if not (self._extractor and self._extractor.is_alive()):
+                self._extractor = threading.Thread(target=self._extract_loop, name="content-extractor", daemon=True)
+                self._extractor.start()
+        self._pending_event.set()
+
+    def is_indexing(self, user_id) -> bool:
+        with self._pending_lock:
+            return user_id in self._pending or self._extracting == user_id
+
+    def _extract_loop(self):
+        while True:
+            self._pending_event.wait()
+            with self._pending_lock:
+                if not self._pending:
+                    self._pending_event.clear()
+                    continue
+                user_id, user_root = self._pending.popitem(last=False)
+                self._extracting = user_id
+            try:
+                if not self.is_built(user_id):
+                    self.rebuild(user_id, user_root)
+                if self.extract_pending(user_id, user_root) >= self.content_batch:
+                    # More to do: back of the queue, so one large tree doesn't starve other users
+                    with self._pending_lock:
+                        self._pending.setdefault(user_id, user_root)
+            except Exception as e:
+                self._extract_stats["last_error"] = str(e)
+                log.error(f"❌ Content extraction failed for user {user_id}: {e}", exc_info=True)
+            finally:
+                with self._pending_lock:
+                    self._extracting = None
+
+    def is_built(self, user_id) -> bool:
+        with closing(self._connect(user_id)) as conn:
+            return conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is not None
+
+    def extract_pending(self, user_id, user_root: Path, limit=None) -> int:
+        """
+        Extracts text for up to `limit` files whose text is missing or outdated.
+        Returns how many files were processed (0 once the user is up to date).
+        """
+        extensions = sorted(supported_extensions())
+        with closing(self._connect(user_id)) as conn:
+            pending = conn.execute(
+                f"SELECT e.id, e.path, e.ext, e.size, e.mtime FROM entries e LEFT JOIN extracted x ON x.id = e.id "
+                f"WHERE e.is_dir = 0 AND e.ext IN ({', '.join('?' * len(extensions))}) "
+                f"AND (x.id IS NULL OR x.mtime != e.mtime OR x.size IS NOT e.size) LIMIT ?",
+                extensions + [limit or self.content_batch]
+            ).fetchall()
+        results = []
+        for entry_id, rel_path, ext, size, mtime in pending:
+            text, error = None, None
+            if size is not None and size > self.content_max_bytes:
+                error = "too large"
+                self._extract_stats["skipped_large"] += 1
+            else:
+                try:
+                    text = extract_text(user_root / rel_path, ext, self.content_max_chars)
+                    self._extract_stats["extracted"] += 1
+                except (ExtractionError, OSError) as e:
+                    error = str(e)[:200]
+                    self._extract_stats["failed"] += 1
+            results.append((entry_id, size, mtime, text, error))
+        if results:
+            with closing(self._connect(user_id)) as conn, conn:
+                for entry_id, size, mtime, text, error in results:
+                    # Skip entries deleted while we were reading the file
+                    if conn.execute("SELECT 1 FROM entries WHERE id = ?", (entry_id,)).fetchone() is None:
+                        continue
+                    conn.execute("DELETE FROM contents WHERE rowid = ?", (entry_id,))
+                    if text:
+                        conn.execute("INSERT INTO contents (rowid, body) VALUES (?, ?)", (entry_id, text))
+                    conn.execute("INSERT OR REPLACE INTO extracted (id, size, mtime, error) VALUES (?, ?, ?, ?)",
+                                 (entry_id, size, mtime, error))
+        return len(pending)
+
+    def extract_stats(self) -> dict:
+        with self._pending_lock:
+            queued = len(self._pending)
+        return dict(self._extract_stats, enabled=self.enabled and self.content_enabled and self._content is not False,
+                    queued_users=queued, running=bool(self._extractor and self._extractor.is_alive()))
+
+    # --- Queries ---
+
+    def search(self, user_id, user_root: Path, query, limit=100, offset=0, extensions=None,
+               min_size=None, max_size=None, modified_after=None, modified_before=None):
+        """
+        Files whose name contains `query` (case-insensitive), ordered by path.
+        Builds the index first if needed. Returns (path, size, mtime) tuples.
+        """
+        with closing(self._connect(user_id)) as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is None:
+                self.rebuild(user_id, user_root)
+
+            sql = "SELECT e.path, e.size, e.mtime FROM entries e"
+            where, params = ["e.is_dir = 0"], []
+            if self._fts and len(query) >= FTS_MIN_QUERY:
+                sql += " JOIN entries_fts ON entries_fts.rowid = e.id"
+                where.append("entries_fts MATCH ?")
+                params.append('"' + query.replace('"', '""') + '"')
+            else:
+                where.append("e.name LIKE ? ESCAPE '\\'")
+                params.append(f"%{_escape_like(query)}%")
+            filter_where, filter_params = _filter_clauses(extensions, min_size, max_size, modified_after, modified_before)
+            where += filter_where
+            params += filter_params
+            sql += f" WHERE {' AND '.join(where)} ORDER BY e.path LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+            return conn.execute(sql, params).fetchall()
+
+    def search_content(self, user_id, query, limit=100, offset=0, extensions=None,
+                       min_size=None, max_size=None, modified_after=None, modified_before=None):
+        """
+        Files whose extracted text contains every term of `query`, best bm25 rank
+        first. Reads the index only; files not extracted yet are simply absent.
+        Returns (path, size, mtime, snippet, score) tuples.
+        """
+        match = _content_match(query)
+        if not match or not self.is_built(user_id):
+            return []
+        where, params = ["contents MATCH ?"], [match]
+        filter_where, filter_params = _filter_clauses(extensions, min_size, max_size, modified_after, modified_before)
+        where += filter_where
+        params += filter_params + [limit, offset]
+        with closing(self._connect(user_id)) as conn:
+            return conn.execute(
+                f"SELECT e.path, e.size, e.mtime, snippet(contents, 0, '{SNIPPET_START}', '{SNIPPET_END}', '…', 16), "
+                f"contents.rank FROM contents JOIN entries e ON e.id = contents.rowid "
+                f"WHERE {' AND '.join(where)} ORDER BY contents.rank LIMIT ? OFFSET ?",
+                params
+            ).fetchall()
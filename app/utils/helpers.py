@@ -1,17 +1,37 @@
-from flask import current_app
+import base64
+import binascii
+import json
+import threading
+from collections import Counter
+from flask import current_app, g, request
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-from werkzeug.exceptions import Forbidden, NotFound, Unauthorized
+from werkzeug.exceptions import BadRequest, Forbidden, NotFound, Unauthorized
 
 # Import your Database instance from extensions
 from app.extensions import db
 # Import custom exceptions if needed for type hinting or specific checks
 from app.exceptions import UserNotFoundError, AccessDeniedError, ServiceError
 
+# Per-endpoint count of identity lookups answered from the request cache
+# (each one is a saved find_user_by_email round-trip). Process-wide.
+_identity_cache_hits = Counter()
+_identity_cache_lock = threading.Lock()
+
+
+def get_identity_cache_stats() -> dict:
+    """Returns {endpoint: saved_lookups} for this worker."""
+    with _identity_cache_lock:
+        return dict(_identity_cache_hits)
+
+
 def get_current_user_doc_and_id():
     """
     Gets the user document and ID for the currently authenticated JWT identity.
     Requires that verify_jwt_in_request() was called successfully beforehand
     (usually via @jwt_required or the audit decorator).
+    The result is memoized on flask.g, so repeated calls in one request
+    (route body, admin_required, resolve_target_user, ...) hit the DB once.
+    Services that write a user doc drop the memo with forget_current_user.
     Returns (user_doc, user_id) or raises NotFound/Unauthorized.
     """
     try:
@@ -21,6 +41,13 @@ def get_current_user_doc_and_id():
             current_app.logger.warning("get_current_user_doc_and_id called without JWT identity.")
             raise Unauthorized("No user identity found in token.")
 
+        cached = g.get("_current_user")
+        if cached and cached[0] == user_email:
+            with _identity_cache_lock:
+                _identity_cache_hits[request.endpoint or "unknown"] += 1
+            user_doc = cached[1]
+            return (user_doc, user_doc.id)
+
         # Use Database method
         user_doc = db.find_user_by_email(user_email)
         if not user_doc:
@@ -28,6 +55,7 @@ def get_current_user_doc_and_id():
             current_app.logger.warning(f"User document not found for valid JWT identity: {user_email}")
             raise NotFound("User associated with token not found.") # Or Unauthorized? NotFound seems appropriate.
 
+        g._current_user = (user_email, user_doc)
         return (user_doc, user_doc.id)
 
     except Exception as e:
@@ -37,6 +65,16 @@ def get_current_user_doc_and_id():
         raise ServiceError("Failed to retrieve current user information.") from e
 
 
+def forget_current_user(user_id: str | None = None):
+    """
+    Drops the request's current-user memo after a write to that user doc (any
+    user when user_id is None), so the next get_current_user_doc_and_id reloads it.
+    """
+    cached = g.get("_current_user")
+    if cached and (user_id is None or cached[1].id == user_id):
+        g.pop("_current_user", None)
+
+
 def get_user_doc(user_id: str):
     """Fetches a user document by ID using the database module."""
     user_doc = db.find_user_by_id(user_id) # Use Database method
@@ -128,4 +166,93 @@ def resolve_target_user(requested_id: str | None) -> tuple[str, dict]:
         return requested_id, target_doc
     else:
         current_app.logger.warning(f"User {caller_id} (role: {caller_role}) DENIED action on behalf of user {requested_id}.")
-        raise Forbidden("Not authorized to access this user's data.")
\ No newline at end of file
+        raise Forbidden("Not authorized to access this user's data.")
+
+
+# --- Cursor pagination helpers ---
+
+def encode_page_cursor(bookmark: str | None, sort: str) -> str | None:
+    """Opaque cursor for the next page: the Mango bookmark plus the sort it belongs to."""
+    if not bookmark:
+        return None
+    raw = json.dumps({"b": bookmark, "s": sort}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def get_page_args(default_sort: str, sort_fields) -> dict:
+    """
+    Parses ?limit=&sort=&cursor= for list endpoints.
+    sort is one of sort_fields, prefixed with '-' for descending. A cursor carries
+    its own sort, which wins over the sort parameter. paginated is False when
+    neither limit nor cursor was given (endpoints that predate pagination then
+    answer with their legacy full list, see collect_all_pages).
+    Returns dict(limit, bookmark, sort, sort_field, descending, paginated) or raises BadRequest.
+    """
+    default_limit = current_app.config.get("PAGE_SIZE_DEFAULT", 100)
+    max_limit = current_app.config.get("PAGE_SIZE_MAX", 1000)
+    try:
+        limit = int(request.args.get("limit", default_limit))
+    except ValueError:
+        raise BadRequest("'limit' must be an integer.")
+    limit = max(1, min(limit, max_limit))
+
+    bookmark = None
+    sort = request.args.get("sort", default_sort)
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            decoded = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+            bookmark, sort = decoded["b"], decoded["s"]
+        except (ValueError, KeyError, TypeError, binascii.Error):
+            raise BadRequest("Invalid 'cursor'.")
+        if not isinstance(bookmark, str) or not isinstance(sort, str):
+            raise BadRequest("Invalid 'cursor'.")
+    sort_field = sort[1:] if sort.startswith("-") else sort
+    if sort_field not in sort_fields:
+        raise BadRequest(f"'sort' must be one of {', '.join(sorted(sort_fields))} (prefix '-' for descending).")
+
+    return {
+        "limit": limit,
+        "bookmark": bookmark,
+        "sort": sort,
+        "sort_field": sort_field,
+        "descending": sort.startswith("-"),
+        "paginated": "limit" in request.args or bool(cursor),
+    }
+
+
+def collect_all_pages(fetch_page, page_args: dict) -> list:
+    """
+    Legacy unpaginated response: follows bookmarks with PAGE_SIZE_MAX-sized pages.
+    fetch_page(limit, bookmark) returns (items, next_bookmark).
+    """
+    limit = current_app.config.get("PAGE_SIZE_MAX", 1000)
+    items, bookmark = [], None
+    while True:
+        page_items, bookmark = fetch_page(limit, bookmark)
+        items.extend(page_items)
+        if not bookmark:
+            return items
+
+
+def page_response(items_key: str, items: list, next_bookmark: str | None, page_args: dict) -> dict:
+    """Standard envelope for paginated list responses."""
+    return {
+        items_key: items,
+        "limit": page_args["limit"],
+        "sort": page_args["sort"],
+        "next": encode_page_cursor(next_bookmark, page_args["sort"]),
+    }
+
+
+def add_preview_headers(response, render_info: dict):
+    """Reports how a preview was produced (see FileService.get_file_for_preview) and sandboxes HTML previews."""
+    if render_info:
+        renderer = render_info["renderer"] + ("-cached" if render_info["cached"] else "")
+        response.headers["X-Preview-Renderer"] = renderer
+        response.headers["Server-Timing"] = f'preview;desc="{renderer}";dur={render_info["duration_ms"]}'
+    if response.mimetype == "text/html":
+        # Rendered from user content: no scripts, no external loads, opaque origin
+        response.headers["Content-Security-Policy"] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    return response
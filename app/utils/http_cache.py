@@ -0,0 +1,140 @@
+# app/utils/http_cache.py
+"""
+HTTP caching for file responses: strong validators, conditional GET and Range requests.
+
+Flask's send_file already answers If-None-Match/If-Modified-Since and single
+ranges, but its ETag hashes the file name and it rejects multi-range requests
+with 416. send_cached_file keeps send_file (and its sendfile fast path) for
+everything it handles and adds inode based ETags, multipart/byteranges
+responses and an explicit Cache-Control policy per route.
+"""
+
+import os
+import uuid
+
+from flask import request, send_file, Response
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+
+MAX_RANGES = 16 # More (after merging) than this and the Range header is ignored: full 200
+CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(st: os.stat_result) -> str:
+    """Strong validator: any rewrite or replacement of the file changes inode, size or mtime."""
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def send_cached_file(path_or_file, mimetype: str, cache_control: str, as_attachment: bool = False,
+                     download_name: str = None) -> Response:
+    """
+    send_file for a path (or buffer) with ETag/Last-Modified validators, 304/412 on
+    matching conditional requests, 206 for single and multiple byte ranges, 416 for
+    unsatisfiable ones, and the given Cache-Control header.
+    """
+    etag = last_modified = size = None
+    if isinstance(path_or_file, (str, os.PathLike)):
+        st = os.stat(path_or_file)
+        etag, last_modified, size = file_etag(st), st.st_mtime, st.st_size
+
+    # werkzeug's parser rejects overlapping or unordered ranges, which RFC 9110 allows (and we merge)
+    requested = _parse_ranges(request.headers.get("Range"))
+    multi_range = requested is not None and len(requested) > 1
+    response = send_file(path_or_file, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name,
+                         conditional=not multi_range, etag=etag or False, last_modified=last_modified)
+    if multi_range and size is not None: # Buffers (uncached previews) just get the full body
+        response.make_conditional(request.environ) # 304/412 only, ranges are handled below
+        if_range_matches = "HTTP_IF_RANGE" not in request.environ or not is_resource_modified(
+            request.environ, etag, last_modified=response.last_modified, ignore_if_range=False)
+        if response.status_code == 200 and if_range_matches:
+            ranges = _satisfiable_ranges(requested, size)
+            if not ranges:
+                response.close()
+                raise RequestedRangeNotSatisfiable(length=size)
+            if len(ranges) <= MAX_RANGES:
+                response.close()
+                response = _range_response(path_or_file, ranges, size, mimetype, response.headers)
+
+    if size is not None:
+        response.accept_ranges = "bytes"
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def _parse_ranges(header):
+    """[(start, stop or None)] from a bytes Range header (start < 0 for suffix ranges), None if invalid."""
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for item in spec.split(","):
+        first, sep, last = item.strip().partition("-")
+        if not sep or not (first or last) or not (first or "0").isdigit() or not (last or "0").isdigit():
+            return None
+        if not first:
+            ranges.append((-int(last), None) if int(last) else (0, 0)) # "-0" is valid but selects nothing
+        elif not last:
+            ranges.append((int(first), None))
+        elif int(last) >= int(first):
+            ranges.append((int(first), int(last) + 1))
+        else:
+            return None
+    return ranges
+
+
+def _satisfiable_ranges(requested, size):
+    """Absolute, sorted, merged (start, stop) byte ranges; unsatisfiable ones are dropped."""
+    ranges = []
+    for start, stop in requested:
+        if start < 0: # Suffix range: the last -start bytes
+            start, stop = max(size + start, 0), size
+        stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _range_response(path, ranges, size, mimetype, headers):
+    """206 with one range (Content-Range) or several (multipart/byteranges)."""
+    if len(ranges) == 1:
+        parts, tail = [(b"", *ranges[0])], b""
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [(f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+                  .encode("latin-1"), start, stop) for start, stop in ranges]
+        tail = f"\r\n--{boundary}--\r\n".encode("latin-1")
+
+    def generate():
+        with open(path, "rb") as f:
+            for part_header, start, stop in parts:
+                yield part_header
+                f.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        return # File shrank while streaming
+                    remaining -= len(chunk)
+                    yield chunk
+            yield tail
+
+    response = Response(generate(), status=206, direct_passthrough=True)
+    for name in ("ETag", "Last-Modified", "Content-Disposition", "Date"):
+        if name in headers:
+            response.headers[name] = headers[name]
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response.mimetype = mimetype
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    else:
+        response.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+    response.content_length = sum(len(header) + stop - start for header, start, stop in parts) + len(tail)
+    return response
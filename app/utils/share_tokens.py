@@ -0,0 +1,58 @@
+# app/utils/share_tokens.py
+"""
+Self-contained signed share tokens: v1.<payload>.<signature>
+
+payload is base64url JSON ({"o": owner_id, "p": relative path, "d": allow_download,
+"e": expiry as epoch seconds or null, "n": random nonce}), signature is the
+base64url HMAC-SHA256 of "v1.<payload>". Verifying needs only the key.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import secrets
+
+SIGNED_PREFIX = "v1."
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(signing_input: str, key: bytes) -> str:
+    return _b64encode(hmac.new(key, signing_input.encode("ascii"), hashlib.sha256).digest())
+
+
+def is_signed_token(token: str) -> bool:
+    return token.startswith(SIGNED_PREFIX)
+
+
+def sign_share_token(owner_id: str, file_path: str, allow_download: bool,
+                     expires_at: int | None, key: bytes) -> str:
+    payload = {"o": owner_id, "p": file_path, "d": bool(allow_download),
+               "e": expires_at, "n": _b64encode(secrets.token_bytes(9))}
+    signing_input = SIGNED_PREFIX + _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return f"{signing_input}.{_signature(signing_input, key)}"
+
+
+def verify_share_token(token: str, key: bytes) -> dict | None:
+    """Returns the payload if the token is well-formed and correctly signed, else None.
+       Expiry is not checked here."""
+    if not is_signed_token(token) or token.count(".") != 2:
+        return None
+    signing_input, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(signature, _signature(signing_input, key)):
+        return None
+    try:
+        payload = json.loads(_b64decode(signing_input[len(SIGNED_PREFIX):]))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(payload, dict) or not payload.get("o") or not payload.get("p"):
+        return None
+    return payload
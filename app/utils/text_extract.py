@@ -0,0 +1,93 @@
+# app/utils/text_extract.py
+"""Plain-text extraction for the content search index (text, PDF, docx)."""
+
+import logging
+import shutil
+import subprocess
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+log = logging.getLogger(__name__)
+
+try:
+    import pypdf # Optional: used when poppler's pdftotext is not installed
+except ImportError:
+    pypdf = None
+
+TEXT_EXTENSIONS = {"txt", "md", "csv", "tsv", "log", "json", "xml", "html", "htm", "yaml", "yml", "ini"}
+PDF_EXTENSIONS = {"pdf"}
+DOCX_EXTENSIONS = {"docx"}
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class ExtractionError(Exception):
+    """The file could not be read as the type its extension claims."""
+
+
+def supported_extensions() -> set:
+    extensions = TEXT_EXTENSIONS | DOCX_EXTENSIONS
+    if pypdf is not None or shutil.which("pdftotext"):
+        extensions |= PDF_EXTENSIONS
+    return extensions
+
+
+def extract_text(path: Path, ext: str, max_chars: int, timeout: float = 60) -> str:
+    """Returns up to max_chars of text from the file, raising ExtractionError on failure."""
+    if ext in TEXT_EXTENSIONS:
+        with open(path, "rb") as f:
+            raw = f.read(max_chars * 4) # Up to 4 bytes per UTF-8 character
+        return raw.decode("utf-8", errors="replace")[:max_chars]
+    if ext in DOCX_EXTENSIONS:
+        return _extract_docx(path, max_chars)
+    if ext in PDF_EXTENSIONS:
+        return _extract_pdf(path, max_chars, timeout)
+    raise ExtractionError(f"No text extractor for '.{ext}' files.")
+
+
+def _extract_docx(path, max_chars):
+    try:
+        with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as document:
+            paragraphs, total = [], 0
+            # iterparse keeps memory flat on very large documents
+            for _, element in ElementTree.iterparse(document):
+                if element.tag != f"{W_NS}p":
+                    continue
+                text = "".join(node.text or "" for node in element.iter(f"{W_NS}t"))
+                element.clear()
+                if text:
+                    paragraphs.append(text)
+                    total += len(text) + 1
+                    if total >= max_chars:
+                        break
+            return "\n".join(paragraphs)[:max_chars]
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise ExtractionError(f"Not a readable docx file: {e}") from e
+
+
+def _extract_pdf(path, max_chars, timeout):
+    pdftotext = shutil.which("pdftotext")
+    if pdftotext:
+        try:
+            result = subprocess.run([pdftotext, "-q", "-enc", "UTF-8", str(path), "-"],
+                                    capture_output=True, timeout=timeout, check=False)
+        except subprocess.TimeoutExpired as e:
+            raise ExtractionError(f"pdftotext timed out after {timeout}s") from e
+        if result.returncode != 0:
+            raise ExtractionError(f"pdftotext failed with exit code {result.returncode}")
+        return result.stdout.decode("utf-8", errors="replace")[:max_chars]
+    if pypdf is not None:
+        try:
+            reader = pypdf.PdfReader(str(path))
+            pages, total = [], 0
+            for page in reader.pages:
+                text = page.extract_text() or ""
+                pages.append(text)
+                total += len(text)
+                if total >= max_chars:
+                    break
+            return "\n".join(pages)[:max_chars]
+        except Exception as e: # pypdf raises a wide range of errors on broken files
+            raise ExtractionError(f"Not a readable PDF file: {e}") from e
+    raise ExtractionError("No PDF text extractor installed (pdftotext or pypdf).")
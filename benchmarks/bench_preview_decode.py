@@ -0,0 +1,99 @@
+"""
+Benchmark: image preview decoding, full decode + thumbnail vs. scaled (draft/reduce) decoding.
+
+No CouchDB needed. Writes synthetic JPEG and PNG photos of growing resolution
+to a temp directory, then renders a preview of each in a fresh subprocess per
+method, so the reported peak RSS (growth over the post-import baseline, read
+from /proc, so Linux only) belongs to that render alone. "full" is the old
+pipeline (load() the whole image, then thumbnail); "scaled" is
+FileService._open_preview_image.
+
+    python -m benchmarks.bench_preview_decode [--megapixels 3,12,24,48] [--size 1280] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image
+
+CHILD = r"""
+import json, sys, time
+from pathlib import Path
+from PIL import Image
+from app.services.file_service import FileService
+
+method, path, size, repeat = sys.argv[1], Path(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+service = FileService()
+service.preview_max_pixels = service.preview_max_decode_bytes = float("inf")
+
+def full():
+    img = Image.open(path)
+    img.load()
+    img = img.convert("RGB")
+    img.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=None)
+    return img
+
+def scaled():
+    return service._open_preview_image(path, size)
+
+def rss_kb(field):
+    # VmHWM is the peak RSS; ru_maxrss would include the forking parent's peak
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+fn = full if method == "full" else scaled
+with open("/proc/self/clear_refs", "w") as clear_refs:
+    clear_refs.write("5") # Reset VmHWM to the current RSS
+baseline = rss_kb("VmRSS")
+samples = []
+for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    samples.append((time.perf_counter() - start) * 1000)
+peak = rss_kb("VmHWM")
+print(json.dumps({"ms": sorted(samples)[len(samples) // 2], "peak_mb": (peak - baseline) / 1024}))
+"""
+
+
+def _photo(path, megapixels, fmt):
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # Noise over a gradient: roughly photo-like entropy, so JPEG sizes are realistic
+    base = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    Image.blend(base, noise, 0.5).save(path, format=fmt, quality=90)
+
+
+def _run(method, path, size, repeat):
+    result = subprocess.run([sys.executable, "-c", CHILD, method, path, str(size), str(repeat)],
+                            capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=os.getcwd()))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--megapixels", default="3,12,24,48")
+    parser.add_argument("--size", type=int, default=1280, help="Preview rendition (longest edge, px).")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--formats", default="JPEG,PNG")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'image':<14} {'method':<8} {'p50 ms':>9} {'peak RSS MB':>12}")
+        for fmt in args.formats.split(","):
+            for megapixels in [float(mp) for mp in args.megapixels.split(",")]:
+                path = os.path.join(tmp, f"photo_{megapixels:g}mp.{fmt.lower()}")
+                _photo(path, megapixels, fmt)
+                for method in ("full", "scaled"):
+                    stats = _run(method, path, args.size, args.repeat)
+                    print(f"{f'{megapixels:g} MP {fmt}':<14} {method:<8} {stats['ms']:>9.1f} {stats['peak_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
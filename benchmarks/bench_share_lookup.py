@@ -0,0 +1,86 @@
+"""
+Benchmark: share link resolution, Mango token index vs. token-keyed primary-key GET.
+
+Needs a running CouchDB (same URL as app/database.py). Creates a scratch
+database holding --links active share links, each stored twice: once with a
+random ID (legacy layout, found through idx-share-type-token) and once keyed
+by share:<sha256(token)>. Times random lookups (hits and misses) through both
+paths, then drops the database.
+
+    python -m benchmarks.bench_share_lookup [--links 100000] [--lookups 2000]
+"""
+import argparse
+import random
+import secrets
+import statistics
+import time
+import uuid
+
+from app.database import Database
+
+
+class BenchDatabase(Database):
+    DB_NAME = "nas_db_bench_shares"
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1], samples[int(len(samples) * 0.99) - 1]
+
+
+def _time_lookups(fn, tokens):
+    samples = []
+    for token in tokens:
+        start = time.perf_counter()
+        fn(token)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--links", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=5000, help="Docs per _bulk_docs request while loading.")
+    args = parser.parse_args()
+
+    bench_db = BenchDatabase()
+    if not bench_db.db:
+        raise SystemExit("CouchDB not reachable, see log output above.")
+    try:
+        tokens = []
+        started = time.perf_counter()
+        for offset in range(0, args.links, args.batch):
+            batch = []
+            for _ in range(min(args.batch, args.links - offset)):
+                token = secrets.token_urlsafe(32)
+                tokens.append(token)
+                share = {"type": "share_link", "token": token, "owner_id": "bench", "file_path": "bench.txt",
+                         "share_type": "public", "allow_download": True, "expires_at": None}
+                batch.append(dict(share, _id=uuid.uuid4().hex)) # Legacy layout
+                batch.append(dict(share, _id=bench_db.share_doc_id(token)))
+            bench_db.db.update(batch)
+        print(f"Loaded {args.links} links in {time.perf_counter() - started:.1f}s")
+
+        # Build the Mango index before timing
+        bench_db._find_share_link_legacy(tokens[0])
+
+        hits = random.sample(tokens, min(args.lookups, len(tokens)))
+        misses = [secrets.token_urlsafe(32) for _ in range(len(hits))]
+        by_id = lambda token: bench_db.db.get(bench_db.share_doc_id(token))
+
+        print(f"{'path':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for label, fn, sample in [
+            ("mango index, hit", bench_db._find_share_link_legacy, hits),
+            ("primary key, hit", by_id, hits),
+            ("mango index, miss", bench_db._find_share_link_legacy, misses),
+            ("primary key, miss", by_id, misses),
+        ]:
+            p50, p95, p99 = _percentiles(_time_lookups(fn, sample))
+            print(f"{label:<22} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}")
+    finally:
+        bench_db.couch.delete(BenchDatabase.DB_NAME)
+
+
+if __name__ == "__main__":
+    main()
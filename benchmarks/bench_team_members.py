@@ -0,0 +1,61 @@
+"""
+Benchmark: resolving team member emails one by one vs. in bulk.
+
+Needs a running CouchDB (same URL as app/database.py). Creates a scratch
+database, fills it with users, times per-email find_user_by_email against
+find_users_by_emails for growing member counts, then drops the database.
+
+    python -m benchmarks.bench_team_members [--sizes 1,10,50,100,200,500] [--repeat 3]
+"""
+import argparse
+import statistics
+import time
+
+from app.database import Database
+
+
+class BenchDatabase(Database):
+    DB_NAME = "nas_db_bench_members"
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="1,10,50,100,200,500")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    sizes = [int(n) for n in args.sizes.split(",")]
+
+    bench_db = BenchDatabase()
+    if not bench_db.db:
+        raise SystemExit("CouchDB not reachable, see log output above.")
+    try:
+        emails = [f"bench{i}@example.com" for i in range(max(sizes))]
+        bench_db.db.update([
+            {"_id": f"user:{email}", "type": "user", "email": email, "first_name": "Bench", "last_name": str(i)}
+            for i, email in enumerate(emails)
+        ])
+        # Build view/index files before timing
+        bench_db.find_users_by_emails(emails[:1])
+        bench_db.find_user_by_email(emails[0])
+
+        print(f"{'members':>8} {'per-email ms':>14} {'bulk ms':>10} {'speedup':>8}")
+        for n in sizes:
+            subset = emails[:n]
+            per_email = _time(lambda: [bench_db.find_user_by_email(e) for e in subset], args.repeat)
+            bulk = _time(lambda: bench_db.find_users_by_emails(subset), args.repeat)
+            print(f"{n:>8} {per_email:>14.1f} {bulk:>10.1f} {per_email / bulk if bulk else 0:>7.1f}x")
+    finally:
+        bench_db.couch.delete(BenchDatabase.DB_NAME)
+
+
+if __name__ == "__main__":
+    main()